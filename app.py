@@ -1,14 +1,42 @@
-from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash, send_file
+from flask import Flask, render_template, request, redirect, url_for, session, jsonify, flash, send_file, send_from_directory, abort, g, has_request_context, Response, stream_with_context
+from flask.json.provider import DefaultJSONProvider
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime, timezone
+from flask_sqlalchemy.session import Session as BaseSession
+from sqlalchemy import event as sa_event
+from sqlalchemy.engine import Engine
+from sqlalchemy.schema import CreateIndex
+from sqlalchemy.sql import Select
+from sqlalchemy.ext.horizontal_shard import ShardedSession, set_shard_id
+from datetime import datetime, timezone, timedelta
 import secrets
 import os
 import json
+import gzip
+import hashlib
+import time
+import threading
+import socket
+import random
+import orjson
+import msgpack
 from functools import wraps
+from contextlib import contextmanager
+import click
 import logging
 from werkzeug.utils import secure_filename
-from werkzeug.security import generate_password_hash, check_password_hash
 import re
+import csv
+import io
+import build_assets
+import events
+import snowflake
+import sharding
+import profiling
+from membership import MembershipIndex, LRUDict
+from ephemeral import EphemeralSignalStore
+from read_models import MessageView, columns_for, load_views
+from passwords import PasswordHasher, HashingBusy
+from hot_messages import HotMessageCache
 
 # تنظیمات logging
 logging.basicConfig(level=logging.INFO)
@@ -27,18 +55,327 @@ else:
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///mailgram.db'
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+# replica فقط‌خواندنی (اختیاری)؛ مسیرهای پرخواندن با دکوراتور read_replica به آن هدایت می‌شوند
+replica_url = os.environ.get('DATABASE_REPLICA_URL')
+if replica_url:
+    if replica_url.startswith('postgres://'):
+        replica_url = replica_url.replace('postgres://', 'postgresql://', 1)
+    app.config['SQLALCHEMY_BINDS'] = {'replica': replica_url}
+# شاردهای پیام‌ها (اختیاری): DATABASE_SHARD_URLS با کاما جدا می‌شود؛ هر آدرس bind جداگانه shard<i> است
+shard_urls = [url.strip() for url in os.environ.get('DATABASE_SHARD_URLS', '').split(',') if url.strip()]
+for shard_index, shard_url in enumerate(shard_urls):
+    if shard_url.startswith('postgres://'):
+        shard_url = shard_url.replace('postgres://', 'postgresql://', 1)
+    app.config.setdefault('SQLALCHEMY_BINDS', {})[sharding.shard_name(shard_index)] = shard_url
+shard_router = sharding.ShardRouter(len(shard_urls))
+# مدت زمانی که پس از هر نوشتن، خواندن‌های همان کاربر از دیتابیس اصلی انجام می‌شود (ثانیه)
+app.config['REPLICA_MAX_LAG'] = float(os.environ.get('REPLICA_MAX_LAG', 5))
+# افزودن هدر X-DB-Statements (تعداد دستورات SQL هر درخواست) برای اندازه‌گیری ترافیک دیتابیس
+app.config['DB_STATEMENT_HEADER'] = os.environ.get('DB_STATEMENT_HEADER', 'False').lower() == 'true'
 app.config['PERMANENT_SESSION_LIFETIME'] = 3600 * 24 * 7
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+# آپلود تکه‌ای: هر تکه یک درخواست جداست و مستقیم روی فایل موقت دیسک نوشته می‌شود
+app.config['UPLOAD_CHUNK_SIZE'] = 4 * 1024 * 1024
+app.config['MAX_UPLOAD_SIZE'] = int(os.environ.get('MAX_UPLOAD_SIZE', 2 * 1024 * 1024 * 1024))  # 2GB
+app.config['UPLOAD_SESSION_TTL'] = 24 * 3600  # آپلودهای ناتمام قدیمی‌تر پاک می‌شوند
+UPLOAD_READ_BLOCK = 64 * 1024
+app.config['GZIP_MIN_SIZE'] = 512  # پاسخ‌های JSON کوچک‌تر فشرده نمی‌شوند
+app.config['GZIP_LEVEL'] = 6
+GZIP_MIMETYPES = {'application/json', 'application/msgpack'}
+
+# JSON provider مبتنی بر orjson برای سریال‌سازی سریع و فشرده پاسخ‌ها
+class OrjsonProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        # session serializer از object_hook استفاده می‌کند که orjson پشتیبانی نمی‌کند
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj, default=self.default), mimetype=self.mimetype)
+
+app.json = OrjsonProvider(app)
 
 # ایجاد پوشه آپلود
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+os.makedirs(os.path.join(app.config['UPLOAD_FOLDER'], 'partial'), exist_ok=True)
+
+# باندل‌های CSS/JS هش‌دار (هنگام راه‌اندازی اگر manifest نباشد یا منابع assets/ جدیدتر باشند دوباره ساخته می‌شوند)
+ASSET_MAX_AGE = 365 * 24 * 3600
+asset_manifest = build_assets.ensure_built()
+
+# در حالت debug تغییر منابع بدون راه‌اندازی دوباره در درخواست بعدی اعمال می‌شود
+@app.template_global()
+def asset_url(name):
+    global asset_manifest
+    if app.debug:
+        asset_manifest = build_assets.ensure_built()
+    return url_for('asset_file', filename=asset_manifest[name])
+
+# خواندن از replica فقط وقتی مجاز است که مسیر فعلی read_replica باشد و کاربر اخیراً چیزی ننوشته باشد
+def use_replica():
+    if not has_request_context() or not g.get('read_replica') or g.get('db_wrote'):
+        return False
+    return session.get('primary_until', 0) < time.time()
 
-db = SQLAlchemy(app)
+# جدول‌هایی که بر اساس conversation_id شارد می‌شوند؛ بقیه در دیتابیس اصلی می‌مانند
+SHARDED_TABLES = {'conversation_message', 'conversation_state'}
+
+def is_sharded(mapper):
+    return mapper is not None and mapper.local_table.name in SHARDED_TABLES
+
+def choose_shard(mapper, instance, clause=None):
+    if not is_sharded(mapper):
+        return sharding.PRIMARY
+    if instance is not None:
+        return shard_router.shard_for(instance.conversation_id)
+    if clause is not None:
+        shards = shard_router.shards_for_clause(clause, mapper.local_table.c.conversation_id)
+        if len(shards) == 1:
+            return shards[0]
+    raise ValueError('shard of conversation data cannot be determined')
+
+# جست‌وجو با کلید اصلی (مثلاً دانلود فایل با شناسه پیام) در همه شاردها
+def choose_identity_shards(mapper, primary_key, **kwargs):
+    return shard_router.shards if is_sharded(mapper) else [sharding.PRIMARY]
+
+# شاردهای یک کوئری از شرط conversation_id؛ کوئری بدون آن روی همه شاردها اجرا و نتایج ادغام می‌شود
+def choose_query_shards(orm_context):
+    mapper = orm_context.bind_mapper
+    if not is_sharded(mapper):
+        return [sharding.PRIMARY]
+    return shard_router.shards_for_clause(orm_context.statement, mapper.local_table.c.conversation_id)
+
+# Session مسیریاب:
+#   - پیام‌ها بر اساس conversation_id به شارد خود می‌روند (ShardedSession)
+#   - SELECTهای مسیرهای فقط‌خواندنی به bind «replica» می‌روند
+class RoutingSession(BaseSession, ShardedSession):
+    def __init__(self, db, **kwargs):
+        super().__init__(
+            db,
+            shard_chooser=choose_shard,
+            identity_chooser=choose_identity_shards,
+            execute_chooser=choose_query_shards,
+            **kwargs
+        )
+    
+    def get_bind(self, mapper=None, clause=None, bind=None, shard_id=None, instance=None, **kwargs):
+        if bind is None and shard_router.enabled:
+            if shard_id is None and mapper is not None:
+                shard_id = self._choose_shard_and_assign(db.inspect(mapper), instance, clause=clause)
+            if shard_id is not None and shard_id != sharding.PRIMARY:
+                return self._db.engines[shard_id]
+        if (bind is None and not self._flushing and isinstance(clause, Select)
+                and 'replica' in self._db.engines and use_replica()):
+            return self._db.engines['replica']
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
+
+def shard_engine(shard):
+    return db.engines[None] if shard == sharding.PRIMARY else db.engines[shard]
+
+@sa_event.listens_for(RoutingSession, 'after_flush')
+def mark_request_wrote(db_session, flush_context):
+    if has_request_context():
+        g.db_wrote = True
+
+# read-your-own-writes: بعد از هر نوشتن، خواندن‌های این کاربر تا REPLICA_MAX_LAG ثانیه از دیتابیس اصلی است
+@app.after_request
+def pin_writer_to_primary(response):
+    if g.get('db_wrote') and 'replica' in db.engines:
+        session['primary_until'] = time.time() + app.config['REPLICA_MAX_LAG']
+    return response
+
+# شمارش دستورات SQL هر درخواست روی همه engineها (primary و replica) و نوشتن‌های change log باس رویداد
+@sa_event.listens_for(Engine, 'before_cursor_execute')
+def count_request_statements(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.db_statements = g.get('db_statements', 0) + 1
+
+@app.after_request
+def db_statement_header(response):
+    if app.config['DB_STATEMENT_HEADER']:
+        response.headers['X-DB-Statements'] = str(g.get('db_statements', 0))
+    return response
+
+# باس رویداد بین workerها (پیش‌فرض: change log در فایل SQLite داخل پوشه instance)
+os.makedirs(app.instance_path, exist_ok=True)
+app.config['EVENT_BUS_URL'] = os.environ.get('EVENT_BUS_URL') or 'sqlite:///' + os.path.join(app.instance_path, 'events.db')
+event_bus = events.create_event_bus(app.config['EVENT_BUS_URL'])
+
+@event_bus.on_write
+def count_event_log_write(event):
+    if has_request_context():
+        g.db_statements = g.get('db_statements', 0) + 1
+
+# سیگنال‌های گذرا (تایپ) هرگز در change log نوشته نمی‌شوند: با باس ردیس از pub/sub آن و در غیر این صورت
+# با سوکت‌های یونیکس داخل پوشه instance (workerهای همین سرور) بدون ذخیره‌سازی بین workerها پخش می‌شوند.
+if app.config['EVENT_BUS_URL'].startswith(('redis://', 'rediss://', 'unix://')):
+    default_signal_bus_url = app.config['EVENT_BUS_URL']
+elif hasattr(socket, 'AF_UNIX'):
+    default_signal_bus_url = 'socket:///' + os.path.join(app.instance_path, 'signals')
+else:
+    default_signal_bus_url = 'memory://'
+app.config['SIGNAL_BUS_URL'] = os.environ.get('SIGNAL_BUS_URL') or default_signal_bus_url
+signal_bus = events.create_signal_bus(app.config['SIGNAL_BUS_URL'])
+if app.config['SIGNAL_BUS_URL'].startswith('memory://'):
+    logger.warning("⚠️ SIGNAL_BUS_URL is memory://: typing indicators are not shared between worker processes; "
+                   "run a single worker or set SIGNAL_BUS_URL to socket:/// or redis://")
+
+# خطای باس رویداد نباید درخواست کاربر را خراب کند
+def publish_event(event_type, **payload):
+    try:
+        event_bus.publish(event_type, **payload)
+    except Exception as e:
+        logger.error(f"Event publish error: {str(e)}")
+
+def publish_signal(event_type, **payload):
+    try:
+        signal_bus.publish(event_type, **payload)
+    except Exception as e:
+        logger.error(f"Signal publish error: {str(e)}")
+
+# ==================== Request profiling ====================
+# پروفایل درخواست‌ها برای ادمین:
+#   - flagged: درخواست ادمین با ?_profile=1 (cProfile + نمونه‌بردار + timeline SQL)
+#   - sampled: درصدی از درخواست‌های منطبق با فیلتر مسیر/کاربر (همان داده‌ها)
+#   - slow: درخواست‌های منطبق کندتر از slow_ms فقط با نمونه‌بردار کم‌هزینه و timeline SQL
+# تنظیمات پنل ادمین در دیتابیس ذخیره و هنگام راه‌اندازی هر worker خوانده می‌شود؛ باس رویداد فقط به workerهای
+# در حال اجرا خبر می‌دهد که دوباره بخوانند. نتایج روی دیسک در ring buffer نگه داشته می‌شوند.
+app.config['PROFILE_DIR'] = os.path.join(app.instance_path, 'profiles')
+app.config['PROFILE_MAX'] = 50
+app.config['PROFILE_SAMPLE_INTERVAL'] = 0.005
+PROFILE_SKIP_PREFIXES = ('/assets/', '/static/', '/admin/profiles')
+
+profiling_settings = {
+    'slow_ms': int(os.environ.get('PROFILE_SLOW_MS', 0)),  # 0 یعنی غیرفعال
+    'sample_rate': 0.0,
+    'path_prefix': '',
+    'user_id': ''
+}
+profile_store = profiling.ProfileStore(app.config['PROFILE_DIR'], app.config['PROFILE_MAX'])
+request_sampler = profiling.StackSampler(app.config['PROFILE_SAMPLE_INTERVAL'])
+
+PROFILING_SETTINGS_KEY = 'profiling'
+
+def load_profiling_settings():
+    try:
+        setting = AppSetting.query.get(PROFILING_SETTINGS_KEY)
+        if setting:
+            profiling_settings.update(json.loads(setting.value))
+    except Exception as e:
+        logger.error(f"Profiling settings load error: {str(e)}")
+
+# رویداد در thread شنونده باس می‌رسد، پس خواندن در app context جداگانه انجام می‌شود
+@event_bus.subscribe
+def sync_profiling_settings(event):
+    if event.type == events.PROFILING_CHANGED:
+        with app.app_context():
+            load_profiling_settings()
+
+@app.before_request
+def start_request_profile():
+    if request.path.startswith(PROFILE_SKIP_PREFIXES):
+        return
+    settings = profiling_settings
+    flagged = request.args.get('_profile') == '1' and session.get('is_admin')
+    matches = (request.path.startswith(settings['path_prefix'])
+               and (not settings['user_id'] or session.get('user_id') == settings['user_id']))
+    sampled = matches and settings['sample_rate'] > 0 and random.random() < settings['sample_rate']
+    if not (flagged or sampled or (matches and settings['slow_ms'] > 0)):
+        return
+    g.profile = {
+        'reason': 'flagged' if flagged else 'sampled' if sampled else 'slow',
+        'started': time.perf_counter(),
+        'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'sql': [],
+        'profiler': profiling.new_profiler() if flagged or sampled else None
+    }
+    request_sampler.start(threading.get_ident())
+
+# timeline SQL درخواست در حال پروفایل (زمان شروع نسبت به ابتدای درخواست، مدت و دیتابیس)
+@sa_event.listens_for(Engine, 'before_cursor_execute')
+def start_profiled_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and g.get('profile'):
+        conn.info.setdefault('profile_started', []).append(time.perf_counter())
+
+@sa_event.listens_for(Engine, 'after_cursor_execute')
+def record_profiled_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and g.get('profile') and conn.info.get('profile_started'):
+        started = conn.info['profile_started'].pop()
+        profile = g.profile
+        profile['sql'].append({
+            'start_ms': round((started - profile['started']) * 1000, 2),
+            'duration_ms': round((time.perf_counter() - started) * 1000, 2),
+            'database': next((key or 'primary' for key, engine in db.engines.items() if engine is conn.engine), 'other'),
+            'statement': statement
+        })
+
+@app.after_request
+def finish_request_profile(response):
+    profile = g.pop('profile', None)
+    if not profile:
+        return response
+    duration_ms = (time.perf_counter() - profile['started']) * 1000
+    profiler = profile['profiler']
+    if profiler:
+        profiler.disable()
+    samples = request_sampler.stop(threading.get_ident())
+    if profile['reason'] == 'slow' and duration_ms < profiling_settings['slow_ms']:
+        return response
+    try:
+        profile_id = profile_store.save({
+            'reason': profile['reason'],
+            'method': request.method,
+            'path': request.full_path.rstrip('?'),
+            'endpoint': request.endpoint,
+            'user_id': session.get('user_id'),
+            'status': response.status_code,
+            'started_at': profile['started_at'],
+            'duration_ms': round(duration_ms, 2),
+            'sql_count': len(profile['sql']),
+            'sql_ms': round(sum(item['duration_ms'] for item in profile['sql']), 2),
+            'sql': profile['sql']
+        }, profiler, samples)
+        if profile['reason'] == 'flagged':
+            response.headers['X-Profile-Id'] = profile_id
+    except Exception as e:
+        logger.error(f"Profile save error: {str(e)}")
+    return response
+
+# درخواستی که با exception تمام شده (after_request اجرا نشده) نباید profiler را روشن بگذارد
+@app.teardown_request
+def abort_request_profile(error=None):
+    profile = g.pop('profile', None)
+    if profile:
+        if profile['profiler']:
+            profile['profiler'].disable()
+        request_sampler.stop(threading.get_ident())
+
+# هش رمز عبور خارج از thread درخواست با هزینه قابل تنظیم (روش Werkzeug، مثلاً scrypt:32768:8:1 یا pbkdf2:sha256:600000)
+# با تغییر روش، هش هر کاربر در لاگین موفق بعدی با روش جدید بازنویسی می‌شود.
+app.config['PASSWORD_HASH_METHOD'] = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+app.config['PASSWORD_HASH_WORKERS'] = int(os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 1))
+app.config['PASSWORD_HASH_MAX_PENDING'] = int(os.environ.get('PASSWORD_HASH_MAX_PENDING', app.config['PASSWORD_HASH_WORKERS'] * 4))
+app.config['PASSWORD_HASH_TIMEOUT'] = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 5))
+
+password_hasher = PasswordHasher(
+    method=app.config['PASSWORD_HASH_METHOD'],
+    max_workers=app.config['PASSWORD_HASH_WORKERS'],
+    max_pending=app.config['PASSWORD_HASH_MAX_PENDING'],
+    wait_timeout=app.config['PASSWORD_HASH_TIMEOUT']
+)
 
 # اطلاعات لاگین ادمین (ثابت - پاک نمی‌شود)
 ADMIN_USERNAME = "admin"
-ADMIN_PASSWORD_HASH = generate_password_hash("MailGramAdmin2024!")
+ADMIN_PASSWORD_HASH = password_hasher.hash("MailGramAdmin2024!")
 
 # مدل‌های پایگاه داده
 class User(db.Model):
@@ -62,6 +399,9 @@ class User(db.Model):
             'is_online': self.is_online
         }
 
+# جستجوی پیشوندی نام بدون حساسیت به حروف بزرگ/کوچک (phone و user_id ایندکس unique دارند)
+db.Index('ix_user_name_lower', db.func.lower(User.name))
+
 class Chat(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user1_id = db.Column(db.String(10), nullable=False)
@@ -72,9 +412,25 @@ class Chat(db.Model):
     def get_other_user(self, current_user_id):
         return self.user2_id if self.user1_id == current_user_id else self.user1_id
 
+# شناسه مکالمه برای جدول یکپارچه پیام‌ها
+def chat_conversation_id(chat_id):
+    return f'chat:{chat_id}'
+
+def group_conversation_id(group_id):
+    return f'group:{group_id}'
+
+# شناسه worker همین حالا اجاره می‌شود تا تنظیمات نادرست چندنمونه‌ای هنگام راه‌اندازی خطا بدهد، نه هنگام اولین پیام
+logger.info(f"Snowflake worker id: {snowflake.generator.worker_id}")
+
+# جدول یکپارچه پیام‌های خصوصی و گروهی؛ شناسه‌ها زمان‌مرتب (Snowflake) هستند و مرتب‌سازی/cursor روی کلید اصلی است
 class Message(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    chat_id = db.Column(db.Integer, db.ForeignKey('chat.id'), nullable=False)
+    __tablename__ = 'conversation_message'
+    __table_args__ = (
+        db.Index('ix_conversation_message_conversation', 'conversation_id', 'id'),
+    )
+    
+    id = db.Column(db.BigInteger().with_variant(db.Integer, 'sqlite'), primary_key=True, autoincrement=False, default=snowflake.next_id)
+    conversation_id = db.Column(db.String(32), nullable=False)
     sender_id = db.Column(db.String(10), nullable=False)
     sender_name = db.Column(db.String(100), nullable=False)
     content = db.Column(db.Text, nullable=False)
@@ -83,8 +439,45 @@ class Message(db.Model):
     file_name = db.Column(db.String(500), nullable=True)
     file_size = db.Column(db.Integer, nullable=True)
     timestamp = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+    # رسیدهای چت خصوصی
     read = db.Column(db.Boolean, default=False)
     delivered = db.Column(db.Boolean, default=False)
+    # رسیدهای گروه: JSON list of user_ids who read the message
+    read_by = db.Column(db.Text, default='[]')
+    
+    @property
+    def chat_id(self):
+        kind, _, key = self.conversation_id.partition(':')
+        return int(key) if kind == 'chat' else None
+    
+    @property
+    def group_id(self):
+        kind, _, key = self.conversation_id.partition(':')
+        return key if kind == 'group' else None
+
+# نسخه هر مکالمه (ETag poll و کلید کش دنباله پیام‌ها) به صورت شمارنده کنار پیام‌ها در همان شارد نگه داشته می‌شود
+# و در همان تراکنش ارسال پیام و ثبت رسید جلو می‌رود؛ خواندن نسخه یک lookup با کلید اصلی است نه شمارش پیام‌ها.
+# delivered_count و read_count فقط برای چت خصوصی استفاده می‌شوند.
+class ConversationState(db.Model):
+    __tablename__ = 'conversation_state'
+    
+    conversation_id = db.Column(db.String(32), primary_key=True)
+    last_message_id = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
+    message_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    delivered_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    read_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+CONVERSATION_STATE_COLUMNS = ['conversation_id', 'last_message_id', 'message_count', 'delivered_count', 'read_count']
+
+# نسخه مکالمه‌ها از روی خود پیام‌ها (پر کردن اولیه جدول و بازسازی پس از مهاجرت یا جابه‌جایی شارد)
+def conversation_state_aggregates(*conditions):
+    return (db.select(
+        Message.conversation_id,
+        db.func.max(Message.id),
+        db.func.count(Message.id),
+        db.func.coalesce(db.func.sum(db.case((Message.delivered == True, 1), else_=0)), 0),
+        db.func.coalesce(db.func.sum(db.case((Message.read == True, 1), else_=0)), 0)
+    ).where(*conditions).group_by(Message.conversation_id))
 
 class Group(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -94,8 +487,16 @@ class Group(db.Model):
     group_id = db.Column(db.String(15), unique=True, nullable=False)
     created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     last_activity = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    # تعداد اعضا به صورت شمارنده ذخیره می‌شود تا برای گروه‌های بزرگ اعضا شمرده یا بارگذاری نشوند
+    member_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
 
 class GroupMember(db.Model):
+    # فهرست اعضای گروه به ترتیب عضویت (صفحه‌بندی keyset) و گروه‌های هر کاربر
+    __table_args__ = (
+        db.Index('ix_group_member_group', 'group_id', 'id'),
+        db.Index('ix_group_member_user', 'user_id'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     group_id = db.Column(db.String(15), nullable=False)
     user_id = db.Column(db.String(10), nullable=False)
@@ -103,20 +504,15 @@ class GroupMember(db.Model):
     joined_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     is_admin = db.Column(db.Boolean, default=False)
 
-class GroupMessage(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    group_id = db.Column(db.String(15), nullable=False)
-    sender_id = db.Column(db.String(10), nullable=False)
-    sender_name = db.Column(db.String(100), nullable=False)
-    content = db.Column(db.Text, nullable=False)
-    message_type = db.Column(db.String(20), default='text')
-    file_path = db.Column(db.String(500), nullable=True)
-    file_name = db.Column(db.String(500), nullable=True)
-    file_size = db.Column(db.Integer, nullable=True)
-    timestamp = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
-    read_by = db.Column(db.Text, default='[]')  # JSON list of user_ids who read the message
-
 class MessageLog(db.Model):
+    # ایندکس‌های فیلترهای صفحه لاگ پیام‌ها (همه با id برای صفحه‌بندی keyset)
+    __table_args__ = (
+        db.Index('ix_message_log_sender', 'sender_id', 'id'),
+        db.Index('ix_message_log_receiver', 'receiver_id', 'id'),
+        db.Index('ix_message_log_type', 'message_type', 'id'),
+        db.Index('ix_message_log_timestamp', 'timestamp', 'id'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     message_type = db.Column(db.String(20), nullable=False)  # private, group
     sender_id = db.Column(db.String(10), nullable=False)
@@ -127,13 +523,396 @@ class MessageLog(db.Model):
     timestamp = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
     ip_address = db.Column(db.String(45), nullable=True)
 
+# آپلود تکه‌ای در حال انجام؛ پیشرفت آپلود (offset) همان اندازه فایل موقت روی دیسک است
+class UploadSession(db.Model):
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.String(10), nullable=False)
+    chat_id = db.Column(db.Integer, nullable=True)
+    group_id = db.Column(db.String(15), nullable=True)
+    file_name = db.Column(db.String(500), nullable=False)
+    file_size = db.Column(db.BigInteger, nullable=False)
+    sha256 = db.Column(db.String(64), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+    
+    @property
+    def partial_path(self):
+        return os.path.join(app.config['UPLOAD_FOLDER'], 'partial', f'{self.id}.part')
+    
+    def received(self):
+        try:
+            return os.path.getsize(self.partial_path)
+        except OSError:
+            return 0
+    
+    def to_dict(self):
+        return {
+            'upload_id': self.id,
+            'file_name': self.file_name,
+            'file_size': self.file_size,
+            'offset': self.received(),
+            'chunk_size': app.config['UPLOAD_CHUNK_SIZE']
+        }
+
+# فید تغییرات هر کاربر برای همگام‌سازی کل صندوق (fan-out هنگام نوشتن، در همان تراکنش تغییر اصلی؛
+# پیام گروه‌های بزرگ یک ردیف مشترک دارد که هنگام خواندن ادغام می‌شود)
+# شناسه ردیف cursor کلاینت است. انواع: message، delivered و read (رسید پیام‌های خود کاربر تا message_id)،
+# seen (خواندن مکالمه توسط خود کاربر در تب/دستگاه دیگر) و conversation (چت یا عضویت گروه جدید)
+class UserChange(db.Model):
+    __table_args__ = (
+        db.Index('ix_user_change_user', 'user_id', 'id'),
+        db.Index('ix_user_change_created', 'created_at'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.String(10), nullable=False)
+    kind = db.Column(db.String(20), nullable=False)
+    conversation_id = db.Column(db.String(32), nullable=False)
+    message_id = db.Column(db.BigInteger, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
+
+# تنظیمات زمان اجرا که از پنل ادمین تغییر می‌کنند (مقدار JSON)؛ workerهای جدید هنگام راه‌اندازی آن را می‌خوانند
+class AppSetting(db.Model):
+    key = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.Text, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc),
+                           onupdate=lambda: datetime.now(timezone.utc))
+
 # ایجاد پایگاه داده
 with app.app_context():
+    # محل‌هایی که جدول conversation_state هنوز ندارند؛ پس از ساخت، از روی پیام‌های موجود پر می‌شوند
+    try:
+        state_backfill_locations = [
+            shard for shard in shard_router.shards
+            if not db.inspect(shard_engine(shard)).has_table(ConversationState.__tablename__)
+        ]
+    except Exception as e:
+        state_backfill_locations = []
+        logger.error(f"❌ Conversation state check error: {str(e)}")
+    
     try:
         db.create_all()
+        # create_all روی جدول‌های موجود ایندکس جدید نمی‌سازد؛ reflection در SQLite ایندکس‌های عبارتی را
+        # گزارش نمی‌کند، پس به جای checkfirst از IF NOT EXISTS استفاده می‌شود
+        with db.engine.begin() as connection:
+            for index in MessageLog.__table__.indexes | User.__table__.indexes | GroupMember.__table__.indexes:
+                connection.execute(CreateIndex(index, if_not_exists=True))
+        # جدول پیام‌ها (همراه ایندکس‌هایش) در هر شارد
+        for shard in shard_router.shards:
+            if shard != sharding.PRIMARY:
+                Message.__table__.create(db.engines[shard], checkfirst=True)
+                ConversationState.__table__.create(db.engines[shard], checkfirst=True)
         logger.info("✅ Database tables created successfully")
     except Exception as e:
         logger.error(f"❌ Database creation error: {str(e)}")
+    
+    # ستون member_count در دیتابیس‌های قدیمی (create_all ستون جدید به جدول موجود اضافه نمی‌کند)
+    try:
+        group_columns = {column['name'] for column in db.inspect(db.engine).get_columns(Group.__tablename__)}
+        if 'member_count' not in group_columns:
+            group_table = db.engine.dialect.identifier_preparer.quote(Group.__tablename__)
+            with db.engine.begin() as connection:
+                connection.execute(db.text(f'ALTER TABLE {group_table} ADD COLUMN member_count INTEGER NOT NULL DEFAULT 0'))
+                member_count = (db.select(db.func.count(GroupMember.id))
+                                .where(GroupMember.group_id == Group.group_id)
+                                .scalar_subquery())
+                connection.execute(db.update(Group).values(member_count=member_count))
+            logger.info("✅ Group member counts backfilled")
+    except Exception as e:
+        logger.error(f"❌ Member count migration error: {str(e)}")
+    
+    try:
+        for shard in state_backfill_locations:
+            with shard_engine(shard).begin() as connection:
+                connection.execute(db.insert(ConversationState).from_select(
+                    CONVERSATION_STATE_COLUMNS, conversation_state_aggregates()
+                ))
+        if state_backfill_locations:
+            logger.info("✅ Conversation states backfilled")
+    except Exception as e:
+        logger.error(f"❌ Conversation state migration error: {str(e)}")
+    
+    load_profiling_settings()
+
+# ایندکس عضویت گروه‌ها در حافظه؛ بررسی دسترسی به جای کوئری GroupMember یک lookup در set است
+app.config['MEMBERSHIP_INDEX_MAX_GROUPS'] = 10000
+app.config['MEMBERSHIP_INDEX_MAX_USERS'] = 50000
+app.config['MEMBERSHIP_INDEX_MAX_AGE'] = 300
+
+def load_group_members(group_id):
+    return [row.user_id for row in db.session.query(GroupMember.user_id).filter_by(group_id=group_id)]
+
+def load_user_groups(user_id):
+    return [row.group_id for row in db.session.query(GroupMember.group_id).filter_by(user_id=user_id)]
+
+membership_index = MembershipIndex(
+    load_group_members,
+    load_user_groups,
+    max_groups=app.config['MEMBERSHIP_INDEX_MAX_GROUPS'],
+    max_users=app.config['MEMBERSHIP_INDEX_MAX_USERS'],
+    max_age=app.config['MEMBERSHIP_INDEX_MAX_AGE']
+)
+
+# عضویت‌های ثبت شده در workerهای دیگر
+@event_bus.subscribe
+def sync_membership_index(event):
+    if event.type == events.MEMBERSHIP_CHANGED:
+        membership_index.add(event.payload['group_id'], event.payload['user_id'])
+
+# پاسخ منفی ایندکس با دیتابیس تأیید می‌شود تا عقب بودن رویداد سایر workerها باعث رد دسترسی نشود
+def is_group_member(group_id, user_id):
+    if not group_id:
+        return False
+    if membership_index.is_member(group_id, user_id):
+        return True
+    if GroupMember.query.filter_by(group_id=group_id, user_id=user_id).first():
+        membership_index.add(group_id, user_id)
+        return True
+    return False
+
+# وضعیت «در حال نوشتن…» فقط در حافظه هر worker نگه داشته می‌شود و با باس سیگنال (نه change log) بین workerها پخش می‌شود
+app.config['TYPING_TTL'] = 6
+typing_signals = EphemeralSignalStore(ttl=app.config['TYPING_TTL'])
+
+@signal_bus.subscribe
+def sync_typing_signals(event):
+    if event.type == events.TYPING_CHANGED:
+        payload = event.payload
+        if payload['typing']:
+            typing_signals.set(payload['conversation_id'], payload['user_id'], payload['name'])
+        else:
+            typing_signals.clear(payload['conversation_id'], payload['user_id'])
+
+def typing_names(conversation_id, user_id):
+    return [name for _, name in typing_signals.active(conversation_id, exclude=user_id)]
+
+# طرفین چت هرگز تغییر نمی‌کنند، پس یک بار از دیتابیس خوانده و در حافظه نگه داشته می‌شوند
+chat_participants_cache = LRUDict(50000)
+chat_participants_lock = threading.Lock()
+
+def chat_participants(chat_id):
+    with chat_participants_lock:
+        participants = chat_participants_cache.get(chat_id)
+    if participants is None:
+        with primary_reads():
+            chat = Chat.query.get(chat_id)
+        if not chat:
+            return None
+        participants = (chat.user1_id, chat.user2_id)
+        with chat_participants_lock:
+            chat_participants_cache.put(chat_id, participants)
+    return participants
+
+# ==================== Per-user change feed ====================
+app.config['USER_CHANGE_RETENTION'] = 7 * 24 * 3600
+USER_CHANGE_PRUNE_INTERVAL = 600
+SYNC_BATCH_SIZE = 200
+app.config['SYNC_MAX_WAIT'] = float(os.environ.get('SYNC_MAX_WAIT', 0))
+last_user_change_prune = 0
+
+# شناسه ردیف‌های فید باید به ترتیب commit باشد تا /api/sync با جلو بردن cursor ردیفی با شناسه کوچک‌تر را که هنوز
+# commit نشده رد نکند. SQLite نویسنده‌ها را خودش سریال می‌کند؛ در PostgreSQL تراکنش‌های نویسنده فید پیش از گرفتن
+# شناسه یک advisory lock تراکنشی می‌گیرند که تا commit نگه داشته می‌شود.
+USER_CHANGE_LOCK_KEY = 0x4d47_4645_4544
+
+def lock_user_change_feed():
+    if db.session.info.get('user_change_locked'):
+        return
+    connection = db.session.connection(bind_arguments={'mapper': UserChange})
+    if connection.dialect.name == 'postgresql':
+        connection.execute(db.text('SELECT pg_advisory_xact_lock(:key)'), {'key': USER_CHANGE_LOCK_KEY})
+    db.session.info['user_change_locked'] = True
+
+@sa_event.listens_for(RoutingSession, 'after_transaction_end')
+def release_user_change_lock(db_session, transaction):
+    if transaction.parent is None:
+        db_session.info.pop('user_change_locked', None)
+
+# ردیف‌های فید گیرندگان به session اضافه می‌شوند و با commit تغییر اصلی ثبت می‌شوند
+def record_changes(user_ids, kind, conversation_id, message_id=None):
+    lock_user_change_feed()
+    db.session.add_all(
+        UserChange(user_id=recipient, kind=kind, conversation_id=conversation_id, message_id=message_id)
+        for recipient in set(user_ids)
+    )
+
+# اعضای گروه داخل همان تراکنش نوشتن از GroupMember خوانده می‌شوند، نه از ایندکس حافظه‌ای که ممکن است عقب باشد
+def conversation_members(conversation_id):
+    kind, _, key = conversation_id.partition(':')
+    if kind == 'chat':
+        return chat_participants(int(key)) or ()
+    return load_group_members(key)
+
+# گروه‌های بزرگ‌تر از SYNC_FANOUT_MAX_MEMBERS به جای یک ردیف برای هر عضو فقط یک ردیف مشترک (GROUP_FEED_USER) می‌گیرند
+# که /api/sync هنگام خواندن با فید خود کاربر برای گروه‌هایش ادغام می‌کند (fan-out هنگام خواندن)
+app.config['SYNC_FANOUT_MAX_MEMBERS'] = 100
+GROUP_FEED_USER = '*'
+
+def record_message_change(message):
+    # شناسه Snowflake پیام هنگام flush ساخته می‌شود
+    db.session.flush()
+    kind, _, key = message.conversation_id.partition(':')
+    if kind == 'group':
+        member_count = db.session.query(Group.member_count).filter_by(group_id=key).scalar() or 0
+        if member_count > app.config['SYNC_FANOUT_MAX_MEMBERS']:
+            record_changes([GROUP_FEED_USER], 'message', message.conversation_id, message.id)
+            return
+    record_changes(conversation_members(message.conversation_id), 'message', message.conversation_id, message.id)
+
+# ردیف‌های فید کاربر به همراه ردیف‌های مشترک گروه‌های بزرگی که عضو آن‌هاست
+def user_feed_condition(user_id):
+    group_conversation_ids = [group_conversation_id(group_id) for group_id in load_user_groups(user_id)]
+    if not group_conversation_ids:
+        return UserChange.user_id == user_id
+    return db.or_(
+        UserChange.user_id == user_id,
+        db.and_(UserChange.user_id == GROUP_FEED_USER, UserChange.conversation_id.in_(group_conversation_ids))
+    )
+
+# رسیدهای چت خصوصی: فرستنده از تحویل/خوانده شدن پیام‌هایش و خواننده (تب‌های دیگرش) از خوانده شدن مکالمه باخبر می‌شوند
+def record_receipt_changes(conversation_id, user_id, other_user_id, delivered_messages, read_messages):
+    delivered_ids = [msg.id for msg in delivered_messages if msg.sender_id == other_user_id]
+    if delivered_ids:
+        record_changes([other_user_id], 'delivered', conversation_id, max(delivered_ids))
+    if read_messages:
+        last_read_id = max(msg.id for msg in read_messages)
+        record_changes([other_user_id], 'read', conversation_id, last_read_id)
+        record_changes([user_id], 'seen', conversation_id, last_read_id)
+
+# حذف ردیف‌های قدیمی‌تر از USER_CHANGE_RETENTION (حداکثر هر USER_CHANGE_PRUNE_INTERVAL ثانیه در هر worker)
+def prune_user_changes():
+    global last_user_change_prune
+    now = time.time()
+    if now - last_user_change_prune < USER_CHANGE_PRUNE_INTERVAL:
+        return
+    last_user_change_prune = now
+    try:
+        cutoff = datetime.now(timezone.utc) - timedelta(seconds=app.config['USER_CHANGE_RETENTION'])
+        UserChange.query.filter(UserChange.created_at < cutoff).delete(synchronize_session=False)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"User change prune error: {str(e)}")
+
+def current_sync_cursor():
+    return db.session.query(db.func.coalesce(db.func.max(UserChange.id), 0)).scalar()
+
+# مهاجرت جداول قدیمی message و group_message به جدول یکپارچه
+# شناسه‌ها از روی زمان هر پیام با worker رزرو شده ساخته می‌شوند تا ترتیب حفظ شود و با شناسه‌های زنده برخورد نکنند.
+# جدول‌های قدیمی پس از انتقال به *_migrated تغییر نام می‌دهند؛ اجرای دوباره کاری انجام نمی‌دهد.
+@app.cli.command('migrate-messages')
+def migrate_messages_command():
+    inspector = db.inspect(db.engine)
+    legacy_rows = []
+    
+    if inspector.has_table('message'):
+        table = db.Table('message', db.MetaData(), autoload_with=db.engine)
+        for row in db.session.execute(db.select(table)).mappings():
+            legacy_rows.append((row['timestamp'], row['id'], {
+                'conversation_id': chat_conversation_id(row['chat_id']),
+                'read': row['read'],
+                'delivered': row['delivered'],
+                'read_by': '[]'
+            }, row))
+    
+    if inspector.has_table('group_message'):
+        table = db.Table('group_message', db.MetaData(), autoload_with=db.engine)
+        for row in db.session.execute(db.select(table)).mappings():
+            legacy_rows.append((row['timestamp'], row['id'], {
+                'conversation_id': group_conversation_id(row['group_id']),
+                'read': False,
+                'delivered': False,
+                'read_by': row['read_by'] or '[]'
+            }, row))
+    
+    if not legacy_rows:
+        print('No legacy message tables to migrate')
+        return
+    
+    allocator = snowflake.TimestampIdAllocator()
+    legacy_rows.sort(key=lambda item: (item[0], item[1]))
+    conversation_ids = sorted({receipts['conversation_id'] for _, _, receipts, _ in legacy_rows})
+    for timestamp, _, receipts, row in legacy_rows:
+        db.session.add(Message(
+            id=allocator.id_for(timestamp),
+            sender_id=row['sender_id'],
+            sender_name=row['sender_name'],
+            content=row['content'],
+            message_type=row['message_type'],
+            file_path=row['file_path'],
+            file_name=row['file_name'],
+            file_size=row['file_size'],
+            timestamp=timestamp,
+            **receipts
+        ))
+    
+    for table_name in ('message', 'group_message'):
+        if inspector.has_table(table_name):
+            db.session.execute(db.text(f'ALTER TABLE {table_name} RENAME TO {table_name}_migrated'))
+    db.session.flush()
+    rebuild_conversation_states(conversation_ids)
+    db.session.commit()
+    
+    print(f'Migrated {len(legacy_rows)} messages into conversation_message')
+
+# انتقال پیام‌ها به شارد درست پس از تغییر DATABASE_SHARD_URLS (اضافه کردن شارد یا شارد کردن دیتابیس قدیمی)
+# هر دسته ابتدا در مقصد commit و سپس از مبدأ حذف می‌شود؛ قطع شدن وسط کار فقط ردیف تکراری بی‌اثر در مبدأ باقی می‌گذارد
+# و اجرای دوباره آن را پاک می‌کند (خواندن‌ها همیشه از شارد مقصد انجام می‌شود).
+@app.cli.command('rebalance-shards')
+@click.option('--batch-size', default=1000, show_default=True, help='rows moved per transaction')
+@click.option('--dry-run', is_flag=True, help='only report conversations that would move')
+def rebalance_shards_command(batch_size, dry_run):
+    table = Message.__table__
+    state_table = ConversationState.__table__
+    locations = [sharding.PRIMARY] + [shard for shard in shard_router.shards if shard != sharding.PRIMARY]
+    moved_conversations = moved_rows = 0
+    moved_conversation_ids = []
+    
+    for source in locations:
+        source_engine = shard_engine(source)
+        if not db.inspect(source_engine).has_table(table.name):
+            continue
+        
+        with source_engine.connect() as conn:
+            conversation_ids = conn.execute(db.select(table.c.conversation_id).distinct()).scalars().all()
+        
+        for conversation_id in conversation_ids:
+            target = shard_router.shard_for(conversation_id)
+            if target == source:
+                continue
+            moved_conversations += 1
+            if dry_run:
+                print(f'{conversation_id}: {source} -> {target}')
+                continue
+            
+            target_engine = shard_engine(target)
+            while True:
+                with source_engine.connect() as conn:
+                    rows = conn.execute(
+                        db.select(table).where(table.c.conversation_id == conversation_id).order_by(table.c.id).limit(batch_size)
+                    ).mappings().all()
+                if not rows:
+                    break
+                ids = [row['id'] for row in rows]
+                with target_engine.begin() as conn:
+                    existing = set(conn.execute(db.select(table.c.id).where(table.c.id.in_(ids))).scalars())
+                    missing = [dict(row) for row in rows if row['id'] not in existing]
+                    if missing:
+                        conn.execute(table.insert(), missing)
+                with source_engine.begin() as conn:
+                    conn.execute(table.delete().where(table.c.id.in_(ids)))
+                moved_rows += len(rows)
+            with source_engine.begin() as conn:
+                conn.execute(state_table.delete().where(state_table.c.conversation_id == conversation_id))
+            moved_conversation_ids.append(conversation_id)
+    
+    # نسخه مکالمه‌های جابه‌جا شده در شارد مقصد از روی پیام‌هایشان دوباره ساخته می‌شود
+    rebuild_conversation_states(moved_conversation_ids)
+    db.session.commit()
+    
+    if dry_run:
+        print(f'{moved_conversations} conversations would move')
+    else:
+        print(f'Moved {moved_rows} messages in {moved_conversations} conversations across {len(shard_router.shards)} shards')
 
 # دکوراتور برای دسترسی ادمین
 def admin_required(f):
@@ -154,8 +933,391 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# مسیرهای پرخواندن که SELECTهایشان (تاریخچه، دنباله poll) می‌تواند از replica سرویس شود. خواندنی که نتیجه‌اش
+# مبنای نوشتن است (پیدا کردن یا ساختن چت، ردیف‌هایی که ویرایش می‌شوند) داخل primary_reads انجام می‌شود و رسیدها
+# با UPDATE شرطی روی primary ثبت می‌شوند، نه با فهرست شناسه‌های خوانده شده از replica.
+def read_replica(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        g.read_replica = True
+        return f(*args, **kwargs)
+    return decorated_function
+
+@contextmanager
+def primary_reads():
+    if not has_request_context():
+        yield
+        return
+    previous = g.get('read_replica')
+    g.read_replica = False
+    try:
+        yield
+    finally:
+        g.read_replica = previous
+
+# ==================== Conditional polling ====================
+
+# بازه‌ای زیر cursor کلاینت که هر poll دوباره گرفته می‌شود؛ باید از طولانی‌ترین تراکنش ثبت پیام بیشتر باشد
+app.config['POLL_OVERLAP_MS'] = 10000
+
+# ساخت ETag ضعیف از نسخه داده (آخرین شناسه پیام، شمارنده رسیدها و کاربر)
+def make_poll_etag(*parts):
+    raw = ':'.join(str(part) for part in parts)
+    return hashlib.blake2b(raw.encode('utf-8'), digest_size=8).hexdigest()
+
+def not_modified(etag):
+    response = app.response_class(status=304)
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'no-cache, private'
+    return response
+
+def conversation_state(conversation_id):
+    row = db.session.execute(
+        db.select(ConversationState.last_message_id, ConversationState.message_count,
+                  ConversationState.delivered_count, ConversationState.read_count)
+        .where(ConversationState.conversation_id == conversation_id)
+    ).first()
+    return tuple(row) if row else (0, 0, 0, 0)
+
+# نسخه چت خصوصی: آخرین شناسه پیام به همراه تعداد پیام‌ها و پیام‌های تحویل/خوانده شده
+def chat_version(chat_id):
+    return conversation_state(chat_conversation_id(chat_id))
+
+# نسخه گروه: آخرین شناسه پیام و تعداد پیام‌ها
+def group_version(group_id):
+    return conversation_state(group_conversation_id(group_id))[:2]
+
+# جلو بردن نسخه مکالمه در تراکنش جاری (همان شارد پیام‌ها)؛ مکالمه‌ای که هنوز ردیف نسخه ندارد از روی پیام‌هایش ساخته می‌شود
+def bump_conversation_state(conversation_id, last_message_id=None, **increments):
+    values = {getattr(ConversationState, name): getattr(ConversationState, name) + amount for name, amount in increments.items()}
+    if last_message_id is not None:
+        values[ConversationState.last_message_id] = db.case(
+            (ConversationState.last_message_id < last_message_id, last_message_id),
+            else_=ConversationState.last_message_id
+        )
+    updated = (ConversationState.query
+               .filter(ConversationState.conversation_id == conversation_id)
+               .update(values, synchronize_session=False))
+    if not updated:
+        rebuild_conversation_states([conversation_id])
+
+def rebuild_conversation_states(conversation_ids):
+    if not conversation_ids:
+        return
+    (ConversationState.query
+     .filter(ConversationState.conversation_id.in_(conversation_ids))
+     .delete(synchronize_session=False))
+    rows = db.session.execute(conversation_state_aggregates(Message.conversation_id.in_(conversation_ids))).all()
+    db.session.add_all(ConversationState(**dict(zip(CONVERSATION_STATE_COLUMNS, row))) for row in rows)
+
+# ==================== Read models ====================
+
+# مسیرهای فقط‌خواندنی پیام‌ها را با select ستونی به MessageView تبدیل می‌کنند (بدون ساخت شیء ORM)
+MESSAGE_VIEW_COLUMNS = columns_for(MessageView, Message)
+
+def message_views(*conditions, newest_first=False, limit=None):
+    statement = db.select(*MESSAGE_VIEW_COLUMNS).where(*conditions)
+    statement = statement.order_by(Message.id.desc() if newest_first else Message.id.asc())
+    if limit is not None:
+        statement = statement.limit(limit)
+    return load_views(MessageView, db.session.execute(statement))
+
+# ستون‌های نمایش کاربر (همان فیلدهای User.to_dict) برای لیست‌ها؛ ردیف‌ها Row سبک هستند
+USER_VIEW_COLUMNS = (User.id, User.name, User.phone, User.user_id, User.last_seen, User.is_online)
+
+# نمایش کاربران طرف گفتگو (صندوق و عنوان مکالمه‌های همگام‌سازی) در حافظه هر worker؛ با USER_CHANGED از هر worker
+# کنار گذاشته می‌شود و اگر سیگنالی نرسد حداکثر USER_VIEW_CACHE_TTL ثانیه می‌ماند. ورودی (زمان بارگذاری یا باطل شدن، ردیف)
+# است؛ بارگذاری‌ای که پیش از باطل شدن شروع شده ردیف قدیمی را دوباره در کش نمی‌گذارد.
+app.config['USER_VIEW_CACHE_TTL'] = 30
+user_views_cache = LRUDict(50000)
+user_views_lock = threading.Lock()
+
+def user_views(user_ids):
+    views = {}
+    missing = []
+    started = time.monotonic()
+    with user_views_lock:
+        for user_id in set(user_ids):
+            entry = user_views_cache.get(user_id)
+            if entry is not None and entry[1] is not None and started - entry[0] < app.config['USER_VIEW_CACHE_TTL']:
+                views[user_id] = entry[1]
+            else:
+                missing.append(user_id)
+    if missing:
+        with primary_reads():
+            rows = db.session.execute(db.select(*USER_VIEW_COLUMNS).where(User.user_id.in_(missing))).all()
+        with user_views_lock:
+            for row in rows:
+                entry = user_views_cache.get(row.user_id)
+                if entry is None or entry[0] <= started:
+                    user_views_cache.put(row.user_id, (started, row))
+                views[row.user_id] = row
+    return views
+
+@signal_bus.subscribe
+def sync_user_views(event):
+    if event.type == events.USER_CHANGED:
+        with user_views_lock:
+            user_views_cache.put(event.payload['user_id'], (time.monotonic(), None))
+
+def user_view_to_dict(user):
+    return {
+        'id': user.id,
+        'name': user.name,
+        'phone': user.phone,
+        'user_id': user.user_id,
+        'last_seen': user.last_seen.strftime('%H:%M') if user.last_seen else 'آنلاین',
+        'is_online': user.is_online
+    }
+
+# علامت‌گذاری رسید با یک UPDATE شرطی؛ conversation_id مسیر شارد را مشخص می‌کند و (id, sender_id) ردیف‌های تغییر کرده برگردانده می‌شود
+def mark_messages_returning(conversation_id, *conditions, **values):
+    return db.session.execute(
+        db.update(Message)
+        .where(Message.conversation_id == conversation_id, *conditions)
+        .values(**values)
+        .returning(Message.id, Message.sender_id)
+        .execution_options(synchronize_session=False)
+    ).all()
+
+# ==================== Hot message cache ====================
+# آخرین پیام‌های مکالمه‌های فعال در حافظه هر worker (صفحه چت، poll و پیش‌نمایش صندوق)
+app.config['HOT_MESSAGES_PER_CONVERSATION'] = 50
+app.config['HOT_MESSAGES_MAX_BYTES'] = int(os.environ.get('HOT_MESSAGES_MAX_BYTES', 32 * 1024 * 1024))
+
+hot_messages = HotMessageCache(
+    per_conversation=app.config['HOT_MESSAGES_PER_CONVERSATION'],
+    max_bytes=app.config['HOT_MESSAGES_MAX_BYTES']
+)
+
+# پیام‌های جدید و رسیدها با باس سیگنال (بدون change log) به کش همه workerها، از جمله همین worker، اعمال می‌شوند.
+# رسیدن نکردن سیگنال فقط یعنی دنباله آن worker با نسخه دیتابیس نمی‌خواند و دوباره بارگذاری می‌شود.
+# پیام‌های بلندتر از MESSAGE_SIGNAL_MAX_CONTENT بدون رکورد منتشر می‌شوند تا در یک datagram جا شوند.
+MESSAGE_SIGNAL_MAX_CONTENT = 4000
+
+def publish_message_created(message):
+    record = None
+    if len(message.content) <= MESSAGE_SIGNAL_MAX_CONTENT:
+        record = {name: getattr(message, name) for name in MessageView.__slots__}
+        record['timestamp'] = message.timestamp.isoformat()
+    publish_signal(events.MESSAGE_CREATED, conversation_id=message.conversation_id, message_id=message.id,
+                   sender_id=message.sender_id, message=record)
+
+# فقط جدیدترین شناسه‌ها می‌توانند در دنباله کش شده باشند
+def hot_message_ids(message_ids):
+    return sorted(message_ids)[-app.config['HOT_MESSAGES_PER_CONVERSATION']:]
+
+@signal_bus.subscribe
+def sync_hot_messages(event):
+    payload = event.payload
+    if event.type == events.MESSAGE_CREATED and payload['message']:
+        record = dict(payload['message'], timestamp=datetime.fromisoformat(payload['message']['timestamp']))
+        hot_messages.append(payload['conversation_id'], MessageView(**record))
+    elif event.type == events.RECEIPT_UPDATED:
+        conversation_id = payload['conversation_id']
+        if 'read_by' in payload:
+            for message_id, read_by in payload['read_by'].items():
+                hot_messages.update(conversation_id, [int(message_id)], read_by=read_by)
+            return
+        hot_messages.update(conversation_id, payload['delivered'], delivered=True)
+        hot_messages.update(conversation_id, payload['read'], read=True)
+        hot_messages.advance(conversation_id, payload['expected'], payload['version'])
+
+# پیام‌های یک مکالمه بعد از after_id (یا کل تاریخچه)؛ دنباله اخیر از کش و فقط پیام‌های قدیمی‌تر از دیتابیس
+# version همان نسخه‌ای است که endpoint برای ETag از دیتابیس خوانده (chat_version یا group_version)
+def conversation_messages(conversation_id, version, after_id=None):
+    tail = hot_messages.get(conversation_id, version)
+    if tail is None:
+        tail = message_views(Message.conversation_id == conversation_id, newest_first=True,
+                             limit=app.config['HOT_MESSAGES_PER_CONVERSATION'])
+        tail.reverse()
+        hot_messages.put(conversation_id, tail, version)
+    recent = [message for message in tail if message.id > after_id] if after_id else tail
+    # دنباله کش شده کل مکالمه نیست و بازه خواسته شده قدیمی‌تر از اولین پیام آن است
+    if tail and len(tail) < version[1] and (not after_id or after_id < tail[0].id):
+        conditions = [Message.conversation_id == conversation_id, Message.id < tail[0].id]
+        if after_id:
+            conditions.append(Message.id > after_id)
+        return message_views(*conditions) + recent
+    return recent
+
+# پیش‌نمایش صندوق: آخرین شناسه و تعداد پیام همه مکالمه‌ها از conversation_state با یک کوئری برای هر شارد، آخرین پیام از کش
+def latest_messages(conversation_ids):
+    if not conversation_ids:
+        return {}
+    heads = db.session.execute(
+        db.select(ConversationState.conversation_id, ConversationState.last_message_id, ConversationState.message_count)
+        .where(ConversationState.conversation_id.in_(conversation_ids), ConversationState.message_count > 0)
+    ).all()
+    latest = {}
+    for conversation_id, last_id, count in heads:
+        message = hot_messages.latest(conversation_id, (last_id, count))
+        if message is None:
+            message = next(iter(message_views(Message.conversation_id == conversation_id, newest_first=True, limit=1)), None)
+        latest[conversation_id] = message
+    return latest
+
+# رسیدهای تحویل و خواندن چت خصوصی برای کاربر فعلی تا جدیدترین پیام نمایش داده شده (یک UPDATE شرطی برای هر نوع روی primary)
+# پیام‌ها ممکن است از replica خوانده شده باشند، پس ردیف‌های تغییر کرده از RETURNING همان UPDATE گرفته می‌شوند.
+# پس از commit روی رکوردهای پاسخ و کش اعمال می‌شود؛ نسخه جلو رفته (مبنای ETag پاسخ) برگردانده می‌شود.
+def mark_chat_receipts(chat_id, user_id, other_user_id, messages, version):
+    if not messages:
+        return version
+    conversation_id = chat_conversation_id(chat_id)
+    up_to = max(msg.id for msg in messages)
+    delivered_messages = mark_messages_returning(
+        conversation_id, Message.delivered == False, Message.id <= up_to, delivered=True
+    )
+    read_messages = mark_messages_returning(
+        conversation_id, Message.sender_id == other_user_id, Message.read == False, Message.id <= up_to, read=True
+    )
+    if delivered_messages or read_messages:
+        bump_conversation_state(conversation_id, delivered_count=len(delivered_messages), read_count=len(read_messages))
+    record_receipt_changes(conversation_id, user_id, other_user_id, delivered_messages, read_messages)
+    db.session.commit()
+    
+    delivered_ids = {msg.id for msg in delivered_messages}
+    read_ids = {msg.id for msg in read_messages}
+    for msg in messages:
+        if msg.id in delivered_ids:
+            msg.delivered = True
+        if msg.id in read_ids:
+            msg.read = True
+    if not delivered_ids and not read_ids:
+        return version
+    new_version = (version[0], version[1], version[2] + len(delivered_ids), version[3] + len(read_ids))
+    publish_signal(events.RECEIPT_UPDATED, conversation_id=conversation_id,
+                   delivered=hot_message_ids(delivered_ids), read=hot_message_ids(read_ids),
+                   expected=version, version=new_version)
+    return new_version
+
+# خوانده شدن پیام‌های گروه توسط کاربر فعلی؛ شیء ORM فقط برای پیام‌هایی ساخته می‌شود که هنوز خوانده نشده‌اند
+# (read_by کش ممکن است از worker دیگر عقب باشد، پس تغییر واقعی از روی ردیف دیتابیس تشخیص داده می‌شود)
+def mark_group_read(group_id, user_id, messages):
+    conversation_id = group_conversation_id(group_id)
+    unread_ids = [message.id for message in messages if user_id not in json.loads(message.read_by)]
+    if not unread_ids:
+        return
+    
+    updated_read_by = {}
+    receipts_changed = False
+    with primary_reads():
+        unread_messages = Message.query.filter(Message.conversation_id == conversation_id, Message.id.in_(unread_ids)).all()
+    for message in unread_messages:
+        read_by = json.loads(message.read_by)
+        if user_id not in read_by:
+            read_by.append(user_id)
+            message.read_by = json.dumps(read_by)
+            receipts_changed = True
+        updated_read_by[message.id] = message.read_by
+    if receipts_changed:
+        record_changes([user_id], 'seen', conversation_id, max(message.id for message in messages))
+    db.session.commit()
+    
+    for message in messages:
+        message.read_by = updated_read_by.get(message.id, message.read_by)
+    if receipts_changed:
+        publish_signal(events.RECEIPT_UPDATED, conversation_id=conversation_id,
+                       read_by={message_id: updated_read_by[message_id] for message_id in hot_message_ids(updated_read_by)})
+
+# ==================== Message wire formats ====================
+
+# فرمت پاسخ پیام‌ها: json (پیش‌فرض، لیست dict)، columns (ستونی و فشرده) یا msgpack (همان ستونی با MessagePack)
+def message_wire_format():
+    requested = request.args.get('format')
+    if requested in ('columns', 'msgpack'):
+        return requested
+    if request.accept_mimetypes.best == 'application/msgpack':
+        return 'msgpack'
+    return 'json'
+
+# ساخت payload ستونی: نام فرستنده‌ها یک بار در هر پاسخ، زمان به صورت epoch میلی‌ثانیه از روی شناسه Snowflake
+def message_columns(messages, user_id, receipts=False):
+    senders = {}
+    sender_ids = []
+    sender_names = []
+    ids = []
+    sender_refs = []
+    contents = []
+    message_types = []
+    file_names = []
+    file_sizes = []
+    read = []
+    delivered = []
+    
+    for msg in messages:
+        ref = senders.get(msg.sender_id)
+        if ref is None:
+            ref = senders[msg.sender_id] = len(sender_ids)
+            sender_ids.append(msg.sender_id)
+            sender_names.append(msg.sender_name)
+        ids.append(msg.id)
+        sender_refs.append(ref)
+        contents.append(msg.content)
+        message_types.append(msg.message_type)
+        file_names.append(msg.file_name)
+        file_sizes.append(msg.file_size)
+        if receipts:
+            read.append(msg.read)
+            delivered.append(msg.delivered)
+    
+    columns = {
+        'id': ids,
+        'sender': sender_refs,
+        'ts': [snowflake.timestamp_ms(message_id) for message_id in ids],
+        'content': contents,
+        'message_type': message_types,
+        'file_name': file_names,
+        'file_size': file_sizes
+    }
+    if receipts:
+        columns['read'] = read
+        columns['delivered'] = delivered
+    
+    return {
+        'success': True,
+        'format': 'columns',
+        'me': senders.get(user_id, -1),
+        'sender_ids': sender_ids,
+        'sender_names': sender_names,
+        'columns': columns
+    }
+
+def compact_messages_response(payload, wire_format):
+    if wire_format == 'msgpack':
+        return app.response_class(msgpack.packb(payload), mimetype='application/msgpack')
+    return jsonify(payload)
+
+# فشرده‌سازی gzip پاسخ‌های JSON برای کلاینت‌هایی که پشتیبانی می‌کنند
+@app.after_request
+def compress_response(response):
+    if (response.status_code != 200
+            or response.direct_passthrough
+            or response.mimetype not in GZIP_MIMETYPES
+            or 'Content-Encoding' in response.headers
+            or 'gzip' not in request.headers.get('Accept-Encoding', '').lower()):
+        return response
+
+    data = response.get_data()
+    if len(data) < app.config['GZIP_MIN_SIZE']:
+        return response
+
+    response.set_data(gzip.compress(data, compresslevel=app.config['GZIP_LEVEL']))
+    response.headers['Content-Encoding'] = 'gzip'
+    response.vary.add('Accept-Encoding')
+    return response
+
 # ==================== Routes ====================
 
+# باندل‌های استاتیک با نام هش‌دار هستند و برای همیشه کش می‌شوند
+@app.route('/assets/<path:filename>')
+def asset_file(filename):
+    if filename not in asset_manifest.values():
+        abort(404)
+    response = send_from_directory(build_assets.ASSETS_DIST_DIR, filename, max_age=ASSET_MAX_AGE)
+    response.headers['Cache-Control'] = f'public, max-age={ASSET_MAX_AGE}, immutable'
+    return response
+
 @app.route('/')
 def index():
     if session.get('user_id'):
@@ -186,8 +1348,16 @@ def login():
         
         if existing_user:
             # بررسی رمز عبور
-            if check_password_hash(existing_user.password_hash, password):
+            if password_hasher.verify(existing_user.password_hash, password):
                 # کاربر موجود
+                # بازسازی هش اختیاری است؛ اگر صف پر باشد لاگین موفق رد نمی‌شود و در لاگین بعدی انجام می‌شود
+                if password_hasher.needs_rehash(existing_user.password_hash):
+                    try:
+                        existing_user.password_hash = password_hasher.hash(password)
+                        logger.info(f"Password rehashed: {existing_user.user_id}")
+                    except HashingBusy:
+                        logger.warning(f"Password rehash deferred: {existing_user.user_id}")
+                
                 session['user_id'] = existing_user.user_id
                 session['name'] = existing_user.name
                 session['is_admin'] = False
@@ -196,6 +1366,7 @@ def login():
                 existing_user.last_seen = datetime.now(timezone.utc)
                 existing_user.is_online = True
                 db.session.commit()
+                publish_signal(events.USER_CHANGED, user_id=existing_user.user_id)
                 
                 flash(f'خوش آمدید {existing_user.name}! شناسه شما: {existing_user.user_id}', 'success')
                 logger.info(f"User logged in: {existing_user.name} ({existing_user.user_id})")
@@ -205,7 +1376,7 @@ def login():
         else:
             # کاربر جدید
             user_id = secrets.token_hex(5).upper()
-            password_hash = generate_password_hash(password)
+            password_hash = password_hasher.hash(password)
             
             new_user = User(
                 name=name, 
@@ -217,6 +1388,7 @@ def login():
             
             db.session.add(new_user)
             db.session.commit()
+            publish_signal(events.USER_CHANGED, user_id=user_id)
             
             session['user_id'] = user_id
             session['name'] = name
@@ -225,6 +1397,11 @@ def login():
             flash(f'حساب کاربری جدید ایجاد شد! شناسه شما: {user_id} - لطفاً این شناسه را ذخیره کنید', 'success')
             logger.info(f"New user registered: {name} ({user_id})")
             
+    except HashingBusy:
+        db.session.rollback()
+        logger.warning("Login rejected: password hashing queue is full")
+        flash('سرور در حال حاضر شلوغ است، لطفاً چند لحظه دیگر دوباره تلاش کنید', 'error')
+        return redirect('/')
     except Exception as e:
         db.session.rollback()
         logger.error(f"Login error: {str(e)}")
@@ -245,32 +1422,60 @@ def chats():
             user.last_seen = datetime.now(timezone.utc)
             user.is_online = True
             db.session.commit()
+            publish_signal(events.USER_CHANGED, user_id=user_id)
+        
+        # cursor فید پیش از خواندن لیست گرفته می‌شود تا تغییرات هم‌زمان در اولین همگام‌سازی از دست نروند
+        sync_cursor = current_sync_cursor()
         
         # دریافت تمام چت‌های خصوصی کاربر
-        user_chats = Chat.query.filter(
-            (Chat.user1_id == user_id) | (Chat.user2_id == user_id)
+        user_chats = db.session.execute(
+            db.select(Chat.id, Chat.user1_id, Chat.user2_id)
+            .where((Chat.user1_id == user_id) | (Chat.user2_id == user_id))
         ).all()
         
+        # طرف‌های مقابل همه چت‌ها (از کش نمایش کاربران، بقیه با یک کوئری)
+        other_user_ids = {chat.user2_id if chat.user1_id == user_id else chat.user1_id for chat in user_chats}
+        other_users = user_views(other_user_ids) if other_user_ids else {}
+        
+        # دریافت گروه‌های کاربر (از ایندکس عضویت، به ترتیب آخرین فعالیت)
+        user_group_ids = membership_index.groups_of(user_id)
+        user_groups = db.session.execute(
+            db.select(Group.group_id, Group.name)
+            .where(Group.group_id.in_(user_group_ids))
+            .order_by(Group.last_activity.desc())
+        ).all() if user_group_ids else []
+        
+        # آخرین پیام همه مکالمه‌ها یک‌جا (از کش در صورت به‌روز بودن)
+        last_messages = latest_messages(
+            [chat_conversation_id(chat.id) for chat in user_chats] +
+            [group_conversation_id(group.group_id) for group in user_groups]
+        )
+        
+        # تعداد خوانده‌نشده همه چت‌ها با یک کوئری گروه‌بندی‌شده؛ در چت خصوصی فرستنده‌ای جز کاربر همان طرف مقابل است
+        chat_conversation_ids = [chat_conversation_id(chat.id) for chat in user_chats]
+        unread_counts = dict(db.session.execute(
+            db.select(Message.conversation_id, db.func.count(Message.id))
+            .where(Message.conversation_id.in_(chat_conversation_ids), Message.sender_id != user_id, Message.read == False)
+            .group_by(Message.conversation_id)
+        ).all()) if chat_conversation_ids else {}
+        
         # ساخت لیست چت‌ها با آخرین پیام
         chats_data = []
         for chat in user_chats:
-            other_user_id = chat.get_other_user(user_id)
-            other_user = User.query.filter_by(user_id=other_user_id).first()
+            other_user_id = chat.user2_id if chat.user1_id == user_id else chat.user1_id
+            other_user = other_users.get(other_user_id)
             
             if other_user:
-                # دریافت آخرین پیام
-                last_message = Message.query.filter_by(chat_id=chat.id).order_by(Message.timestamp.desc()).first()
+                conversation_id = chat_conversation_id(chat.id)
+                
+                last_message = last_messages.get(conversation_id)
                 
                 # تعداد پیام‌های خوانده نشده
-                unread_count = Message.query.filter_by(
-                    chat_id=chat.id, 
-                    sender_id=other_user_id,
-                    read=False
-                ).count()
+                unread_count = unread_counts.get(conversation_id, 0)
                 
                 chats_data.append({
                     'chat_id': chat.id,
-                    'other_user': other_user.to_dict(),
+                    'other_user': user_view_to_dict(other_user),
                     'last_message': {
                         'content': last_message.content if last_message else 'شروع گفتگو',
                         'timestamp': last_message.timestamp.strftime('%H:%M') if last_message else '',
@@ -279,24 +1484,19 @@ def chats():
                     'unread_count': unread_count
                 })
         
-        # دریافت گروه‌های کاربر
-        user_groups = GroupMember.query.filter_by(user_id=user_id).all()
         groups_data = []
-        for member in user_groups:
-            group = Group.query.filter_by(group_id=member.group_id).first()
-            if group:
-                # دریافت آخرین پیام گروه
-                last_message = GroupMessage.query.filter_by(group_id=group.group_id).order_by(GroupMessage.timestamp.desc()).first()
-                
-                groups_data.append({
-                    'group_id': group.group_id,
-                    'name': group.name,
-                    'last_message': {
-                        'content': last_message.content if last_message else 'شروع گفتگو',
-                        'timestamp': last_message.timestamp.strftime('%H:%M') if last_message else '',
-                        'sender_name': last_message.sender_name if last_message else ''
-                    }
-                })
+        for group in user_groups:
+            last_message = last_messages.get(group_conversation_id(group.group_id))
+            
+            groups_data.append({
+                'group_id': group.group_id,
+                'name': group.name,
+                'last_message': {
+                    'content': last_message.content if last_message else 'شروع گفتگو',
+                    'timestamp': last_message.timestamp.strftime('%H:%M') if last_message else '',
+                    'sender_name': last_message.sender_name if last_message else ''
+                }
+            })
         
         # مرتب‌سازی بر اساس آخرین پیام
         chats_data.sort(key=lambda x: x['last_message']['timestamp'] if x['last_message']['timestamp'] else '', reverse=True)
@@ -305,7 +1505,8 @@ def chats():
                              user_name=session['name'],
                              user_id=session['user_id'],
                              chats=chats_data,
-                             groups=groups_data)
+                             groups=groups_data,
+                             sync_cursor=sync_cursor)
                              
     except Exception as e:
         logger.error(f"Chats page error: {str(e)}")
@@ -314,6 +1515,7 @@ def chats():
 
 @app.route('/chat/<other_user_id>')
 @login_required
+@read_replica
 def chat_page(other_user_id):
     try:
         user_id = session['user_id']
@@ -324,39 +1526,36 @@ def chat_page(other_user_id):
             flash('کاربر یافت نشد', 'error')
             return redirect('/chats')
         
-        # پیدا کردن یا ایجاد چت
-        chat = Chat.query.filter(
-            ((Chat.user1_id == user_id) & (Chat.user2_id == other_user_id)) |
-            ((Chat.user1_id == other_user_id) & (Chat.user2_id == user_id))
-        ).first()
+        # پیدا کردن یا ایجاد چت (از primary تا replica عقب‌مانده چت تکراری نسازد)
+        with primary_reads():
+            chat = Chat.query.filter(
+                ((Chat.user1_id == user_id) & (Chat.user2_id == other_user_id)) |
+                ((Chat.user1_id == other_user_id) & (Chat.user2_id == user_id))
+            ).first()
         
         if not chat:
             # ایجاد چت جدید
             chat = Chat(user1_id=user_id, user2_id=other_user_id)
             db.session.add(chat)
+            db.session.flush()
+            db.session.add(ConversationState(conversation_id=chat_conversation_id(chat.id)))
+            record_changes([user_id, other_user_id], 'conversation', chat_conversation_id(chat.id))
             db.session.commit()
         
-        # دریافت تمام پیام‌های این چت
-        messages = Message.query.filter_by(chat_id=chat.id).order_by(Message.timestamp.asc()).all()
+        # دریافت تمام پیام‌های این چت (پیام‌های اخیر از کش)
+        version = chat_version(chat.id)
+        messages = conversation_messages(chat_conversation_id(chat.id), version)
         
-        # علامت‌گذاری پیام‌ها به عنوان تحویل شده
-        undelivered_messages = Message.query.filter_by(chat_id=chat.id, delivered=False).all()
-        for msg in undelivered_messages:
-            msg.delivered = True
-        db.session.commit()
-        
-        # علامت‌گذاری پیام‌ها به عنوان خوانده شده
-        unread_messages = Message.query.filter_by(chat_id=chat.id, sender_id=other_user_id, read=False).all()
-        for msg in unread_messages:
-            msg.read = True
-        db.session.commit()
+        # علامت‌گذاری پیام‌ها به عنوان تحویل شده و خوانده شده
+        mark_chat_receipts(chat.id, user_id, other_user_id, messages, version)
         
         return render_template('chat.html',
                              user_name=session['name'],
                              user_id=session['user_id'],
                              other_user=other_user.to_dict(),
                              messages=messages,
-                             chat_id=chat.id)
+                             chat_id=chat.id,
+                             poll_overlap=snowflake.span(app.config['POLL_OVERLAP_MS']))
                              
     except Exception as e:
         logger.error(f"Chat page error: {str(e)}")
@@ -365,13 +1564,13 @@ def chat_page(other_user_id):
 
 @app.route('/group/<group_id>')
 @login_required
+@read_replica
 def group_page(group_id):
     try:
         user_id = session['user_id']
         
         # بررسی عضویت کاربر در گروه
-        membership = GroupMember.query.filter_by(group_id=group_id, user_id=user_id).first()
-        if not membership:
+        if not is_group_member(group_id, user_id):
             flash('شما عضو این گروه نیستید', 'error')
             return redirect('/chats')
         
@@ -380,25 +1579,18 @@ def group_page(group_id):
             flash('گروه یافت نشد', 'error')
             return redirect('/chats')
         
-        # دریافت اعضای گروه
-        members = GroupMember.query.filter_by(group_id=group_id).all()
-        
-        # دریافت پیام‌های گروه
-        messages = GroupMessage.query.filter_by(group_id=group_id).order_by(GroupMessage.timestamp.asc()).all()
+        # دریافت پیام‌های گروه (پیام‌های اخیر از کش)
+        messages = conversation_messages(group_conversation_id(group_id), group_version(group_id))
         
         # آپدیت خوانده شدن پیام‌ها
-        for message in messages:
-            read_by = json.loads(message.read_by)
-            if user_id not in read_by:
-                read_by.append(user_id)
-                message.read_by = json.dumps(read_by)
-        db.session.commit()
+        mark_group_read(group_id, user_id, messages)
         
         return render_template('group.html',
                              user_name=session['name'],
                              user_id=session['user_id'],
                              group=group,
-                             members=members,
+                             member_count=group.member_count,
+                             members_page_size=GROUP_MEMBERS_PAGE_SIZE,
                              messages=messages)
                              
     except Exception as e:
@@ -426,7 +1618,8 @@ def create_group():
             name=name,
             description=description,
             creator_id=user_id,
-            group_id=group_id
+            group_id=group_id,
+            member_count=1
         )
         db.session.add(group)
         
@@ -438,8 +1631,12 @@ def create_group():
             is_admin=True
         )
         db.session.add(creator_member)
+        db.session.add(ConversationState(conversation_id=group_conversation_id(group_id)))
+        record_changes([user_id], 'conversation', group_conversation_id(group_id))
         
         db.session.commit()
+        membership_index.add(group_id, user_id)
+        publish_event(events.MEMBERSHIP_CHANGED, group_id=group_id, user_id=user_id)
         
         flash(f'گروه "{name}" با موفقیت ایجاد شد', 'success')
         logger.info(f"Group created: {name} ({group_id}) by {user_id}")
@@ -469,8 +1666,7 @@ def join_group():
             return redirect('/chats')
         
         # بررسی عضویت قبلی
-        existing_member = GroupMember.query.filter_by(group_id=group_id, user_id=user_id).first()
-        if existing_member:
+        if is_group_member(group_id, user_id):
             flash('شما قبلاً عضو این گروه هستید', 'error')
             return redirect('/chats')
         
@@ -481,7 +1677,12 @@ def join_group():
             user_name=session['name']
         )
         db.session.add(member)
+        # افزایش اتمیک در خود دیتابیس تا عضویت‌های هم‌زمان شمارنده را بازنویسی نکنند
+        Group.query.filter_by(group_id=group_id).update({Group.member_count: Group.member_count + 1})
+        record_changes([user_id], 'conversation', group_conversation_id(group_id))
         db.session.commit()
+        membership_index.add(group_id, user_id)
+        publish_event(events.MEMBERSHIP_CHANGED, group_id=group_id, user_id=user_id)
         
         flash(f'شما با موفقیت به گروه "{group.name}" پیوستید', 'success')
         logger.info(f"User {user_id} joined group {group_id}")
@@ -493,6 +1694,66 @@ def join_group():
     
     return redirect('/chats')
 
+# فهرست اعضای گروه به صورت صفحه‌بندی شده؛ صفحه گروه اعضا را بارگذاری نمی‌کند و این فهرست فقط با درخواست کاربر خوانده می‌شود
+GROUP_MEMBERS_PAGE_SIZE = 50
+GROUP_MEMBERS_MAX_PAGE_SIZE = 200
+
+# صفحه‌بندی keyset به ترتیب عضویت؛ cursor همان id آخرین عضو صفحه قبل است
+def group_members_page(group_id, query=None, after_id=None, limit=GROUP_MEMBERS_PAGE_SIZE):
+    members_query = db.session.query(
+        GroupMember.id, GroupMember.user_id, GroupMember.user_name, GroupMember.is_admin, GroupMember.joined_at
+    ).filter(GroupMember.group_id == group_id)
+    if query:
+        conditions = [db.func.lower(GroupMember.user_name).startswith(query.lower(), autoescape=True)]
+        if USER_ID_PREFIX_PATTERN.match(query.upper()):
+            conditions.append(prefix_condition(GroupMember.user_id, query.upper()))
+        members_query = members_query.filter(db.or_(*conditions))
+    if after_id:
+        members_query = members_query.filter(GroupMember.id > after_id)
+    rows = members_query.order_by(GroupMember.id.asc()).limit(limit + 1).all()
+    next_cursor = rows[limit - 1].id if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+@app.route('/api/groups/<group_id>/members')
+@login_required
+@read_replica
+def group_members(group_id):
+    try:
+        user_id = session['user_id']
+        
+        if not is_group_member(group_id, user_id):
+            return jsonify({'success': False, 'message': 'شما عضو این گروه نیستید'})
+        
+        group = db.session.query(Group.member_count).filter_by(group_id=group_id).first()
+        if not group:
+            return jsonify({'success': False, 'message': 'گروه یافت نشد'})
+        
+        query = request.args.get('q', '').strip()[:100]
+        limit = min(request.args.get('limit', GROUP_MEMBERS_PAGE_SIZE, type=int), GROUP_MEMBERS_MAX_PAGE_SIZE)
+        members, next_cursor = group_members_page(group_id, query, request.args.get('after', type=int), max(limit, 1))
+        
+        # وضعیت آنلاین فقط برای اعضای همین صفحه
+        online = dict(db.session.query(User.user_id, User.is_online)
+                      .filter(User.user_id.in_([member.user_id for member in members])).all()) if members else {}
+        
+        return jsonify({
+            'success': True,
+            'member_count': group.member_count,
+            'members': [{
+                'user_id': member.user_id,
+                'name': member.user_name,
+                'is_admin': member.is_admin,
+                'is_online': online.get(member.user_id, False),
+                'is_me': member.user_id == user_id,
+                'joined_at': member.joined_at.strftime('%Y-%m-%d') if member.joined_at else ''
+            } for member in members],
+            'next_cursor': next_cursor
+        })
+        
+    except Exception as e:
+        logger.error(f"Group members error: {str(e)}")
+        return jsonify({'success': False, 'message': 'خطا در دریافت اعضای گروه'})
+
 @app.route('/api/send_message', methods=['POST'])
 @login_required
 def send_message():
@@ -519,7 +1780,7 @@ def send_message():
         
         # ایجاد پیام جدید
         new_message = Message(
-            chat_id=chat_id,
+            conversation_id=chat_conversation_id(chat.id),
             sender_id=user_id,
             sender_name=session['name'],
             content=content
@@ -540,8 +1801,12 @@ def send_message():
             message_type_detail='text'
         )
         db.session.add(message_log)
+        record_message_change(new_message)
+        bump_conversation_state(new_message.conversation_id, last_message_id=new_message.id, message_count=1)
         
         db.session.commit()
+        publish_message_created(new_message)
+        publish_signal(events.TYPING_CHANGED, conversation_id=new_message.conversation_id, user_id=user_id, name=session['name'], typing=False)
         
         logger.info(f"Message sent: {user_id} -> {other_user_id}")
         
@@ -578,13 +1843,12 @@ def send_group_message():
             return jsonify({'success': False, 'message': 'پیام نمی‌تواند خالی باشد'})
         
         # بررسی عضویت در گروه
-        membership = GroupMember.query.filter_by(group_id=group_id, user_id=user_id).first()
-        if not membership:
+        if not is_group_member(group_id, user_id):
             return jsonify({'success': False, 'message': 'شما عضو این گروه نیستید'})
         
         # ایجاد پیام گروهی
-        new_message = GroupMessage(
-            group_id=group_id,
+        new_message = Message(
+            conversation_id=group_conversation_id(group_id),
             sender_id=user_id,
             sender_name=session['name'],
             content=content
@@ -607,8 +1871,12 @@ def send_group_message():
             message_type_detail='text'
         )
         db.session.add(message_log)
+        record_message_change(new_message)
+        bump_conversation_state(new_message.conversation_id, last_message_id=new_message.id, message_count=1)
         
         db.session.commit()
+        publish_message_created(new_message)
+        publish_signal(events.TYPING_CHANGED, conversation_id=new_message.conversation_id, user_id=user_id, name=session['name'], typing=False)
         
         logger.info(f"Group message sent: {user_id} -> {group_id}")
         
@@ -629,6 +1897,102 @@ def send_group_message():
         logger.error(f"Send group message error: {str(e)}")
         return jsonify({'success': False, 'message': 'خطا در ارسال پیام'})
 
+# تشخیص نوع پیام از پسوند فایل
+def file_message_type(filename):
+    file_extension = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+    if file_extension in ['jpg', 'jpeg', 'png', 'gif', 'bmp']:
+        return 'image'
+    elif file_extension in ['mp3', 'wav', 'ogg']:
+        return 'audio'
+    return 'file'
+
+# بررسی مقصد پیام فایل (چت موجود یا عضویت در گروه)؛ پیام خطا یا None
+def file_message_target_error(user_id, chat_id, group_id):
+    if chat_id:
+        return None if Chat.query.get(chat_id) else 'چت یافت نشد'
+    if group_id:
+        return None if is_group_member(group_id, user_id) else 'شما عضو این گروه نیستید'
+    return 'مقصد پیام مشخص نیست'
+
+# ثبت پیام فایل ذخیره شده در چت یا گروه؛ مشترک بین آپلود یک‌جا و آپلود تکه‌ای
+def create_file_message(user_id, chat_id, group_id, file_path, filename, file_size):
+    message_type = file_message_type(filename)
+    
+    error = file_message_target_error(user_id, chat_id, group_id)
+    if error:
+        return jsonify({'success': False, 'message': error})
+    
+    if chat_id:  # پیام خصوصی
+        chat = Chat.query.get(chat_id)
+        other_user_id = chat.get_other_user(user_id)
+        
+        new_message = Message(
+            conversation_id=chat_conversation_id(chat.id),
+            sender_id=user_id,
+            sender_name=session['name'],
+            content=f'فایل {message_type}',
+            message_type=message_type,
+            file_path=file_path,
+            file_name=filename,
+            file_size=file_size
+        )
+        
+        # لاگ برای ادمین
+        message_log = MessageLog(
+            message_type='private',
+            sender_id=user_id,
+            sender_name=session['name'],
+            receiver_id=other_user_id,
+            content=f'فایل {message_type}: {filename}',
+            message_type_detail=message_type
+        )
+        
+    else:  # پیام گروهی
+        new_message = Message(
+            conversation_id=group_conversation_id(group_id),
+            sender_id=user_id,
+            sender_name=session['name'],
+            content=f'فایل {message_type}',
+            message_type=message_type,
+            file_path=file_path,
+            file_name=filename,
+            file_size=file_size
+        )
+        
+        # لاگ برای ادمین
+        message_log = MessageLog(
+            message_type='group',
+            sender_id=user_id,
+            sender_name=session['name'],
+            receiver_id=group_id,
+            content=f'فایل {message_type}: {filename}',
+            message_type_detail=message_type
+        )
+    
+    db.session.add(new_message)
+    db.session.add(message_log)
+    record_message_change(new_message)
+    bump_conversation_state(new_message.conversation_id, last_message_id=new_message.id, message_count=1)
+    db.session.commit()
+    publish_message_created(new_message)
+    
+    logger.info(f"File uploaded: {filename} by {user_id}")
+    
+    return jsonify({
+        'success': True,
+        'message': {
+            'id': new_message.id,
+            'content': new_message.content,
+            'sender_id': new_message.sender_id,
+            'sender_name': new_message.sender_name,
+            'timestamp': new_message.timestamp.strftime('%H:%M'),
+            'is_me': True,
+            'message_type': message_type,
+            'file_name': filename,
+            'file_size': file_size
+        }
+    })
+
 @app.route('/api/upload_file', methods=['POST'])
 @login_required
 def upload_file():
@@ -651,97 +2015,218 @@ def upload_file():
             file.save(file_path)
             file_size = os.path.getsize(file_path)
             
-            # تشخیص نوع فایل
-            file_extension = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
-            if file_extension in ['jpg', 'jpeg', 'png', 'gif', 'bmp']:
-                message_type = 'image'
-            elif file_extension in ['mp3', 'wav', 'ogg']:
-                message_type = 'audio'
-            else:
-                message_type = 'file'
-            
-            if chat_id:  # پیام خصوصی
-                chat = Chat.query.get(chat_id)
-                if not chat:
-                    return jsonify({'success': False, 'message': 'چت یافت نشد'})
-                
-                other_user_id = chat.get_other_user(user_id)
-                
-                new_message = Message(
-                    chat_id=chat_id,
-                    sender_id=user_id,
-                    sender_name=session['name'],
-                    content=f'فایل {message_type}',
-                    message_type=message_type,
-                    file_path=file_path,
-                    file_name=filename,
-                    file_size=file_size
-                )
-                
-                # لاگ برای ادمین
-                message_log = MessageLog(
-                    message_type='private',
-                    sender_id=user_id,
-                    sender_name=session['name'],
-                    receiver_id=other_user_id,
-                    content=f'فایل {message_type}: {filename}',
-                    message_type_detail=message_type
-                )
-                
-            elif group_id:  # پیام گروهی
-                membership = GroupMember.query.filter_by(group_id=group_id, user_id=user_id).first()
-                if not membership:
-                    return jsonify({'success': False, 'message': 'شما عضو این گروه نیستید'})
-                
-                new_message = GroupMessage(
-                    group_id=group_id,
-                    sender_id=user_id,
-                    sender_name=session['name'],
-                    content=f'فایل {message_type}',
-                    message_type=message_type,
-                    file_path=file_path,
-                    file_name=filename,
-                    file_size=file_size
-                )
-                
-                # لاگ برای ادمین
-                message_log = MessageLog(
-                    message_type='group',
-                    sender_id=user_id,
-                    sender_name=session['name'],
-                    receiver_id=group_id,
-                    content=f'فایل {message_type}: {filename}',
-                    message_type_detail=message_type
-                )
-            else:
-                return jsonify({'success': False, 'message': 'مقصد پیام مشخص نیست'})
-            
-            db.session.add(new_message)
-            db.session.add(message_log)
-            db.session.commit()
-            
-            logger.info(f"File uploaded: {filename} by {user_id}")
-            
-            return jsonify({
-                'success': True,
-                'message': {
-                    'id': new_message.id,
-                    'content': new_message.content,
-                    'sender_id': new_message.sender_id,
-                    'sender_name': new_message.sender_name,
-                    'timestamp': new_message.timestamp.strftime('%H:%M'),
-                    'is_me': True,
-                    'message_type': message_type,
-                    'file_name': filename,
-                    'file_size': file_size
-                }
-            })
+            return create_file_message(user_id, chat_id, group_id, file_path, filename, file_size)
         
     except Exception as e:
         db.session.rollback()
         logger.error(f"File upload error: {str(e)}")
         return jsonify({'success': False, 'message': 'خطا در آپلود فایل'})
 
+# ==================== Chunked uploads ====================
+# init -> PUT تکه‌ها با offset (قابل ادامه پس از قطع اتصال) -> complete با بررسی SHA-256
+SHA256_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+def get_upload_session(upload_id):
+    upload = UploadSession.query.get(upload_id)
+    if not upload or upload.user_id != session['user_id']:
+        return None
+    return upload
+
+def discard_upload_session(upload):
+    try:
+        os.remove(upload.partial_path)
+    except OSError:
+        pass
+    db.session.delete(upload)
+
+# پاک کردن آپلودهای رها شده (بدون commit؛ همراه درخواست جاری ثبت می‌شود)
+def expire_upload_sessions():
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=app.config['UPLOAD_SESSION_TTL'])
+    for upload in UploadSession.query.filter(UploadSession.created_at < cutoff).limit(100).all():
+        discard_upload_session(upload)
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+@app.route('/api/uploads', methods=['POST'])
+@login_required
+def init_upload():
+    try:
+        user_id = session['user_id']
+        data = request.get_json(silent=True) or {}
+        chat_id = data.get('chat_id')
+        group_id = data.get('group_id')
+        filename = secure_filename(data.get('file_name') or '')
+        file_size = int(data.get('file_size') or 0)
+        sha256 = (data.get('sha256') or '').lower() or None
+        
+        if not filename:
+            return jsonify({'success': False, 'message': 'فایلی انتخاب نشده'})
+        
+        if file_size <= 0 or file_size > app.config['MAX_UPLOAD_SIZE']:
+            return jsonify({'success': False, 'message': 'حجم فایل مجاز نیست'})
+        
+        if sha256 and not SHA256_PATTERN.match(sha256):
+            return jsonify({'success': False, 'message': 'checksum نامعتبر است'})
+        
+        # دسترسی قبل از دریافت داده بررسی می‌شود
+        if chat_id:
+            chat_id = int(chat_id)
+            participants = chat_participants(chat_id)
+            if not participants:
+                return jsonify({'success': False, 'message': 'چت یافت نشد'})
+            if user_id not in participants:
+                return jsonify({'success': False, 'message': 'دسترسی غیرمجاز'})
+            group_id = None
+        elif group_id:
+            if not is_group_member(group_id, user_id):
+                return jsonify({'success': False, 'message': 'شما عضو این گروه نیستید'})
+        else:
+            return jsonify({'success': False, 'message': 'مقصد پیام مشخص نیست'})
+        
+        expire_upload_sessions()
+        
+        upload = UploadSession(
+            id=secrets.token_hex(16),
+            user_id=user_id,
+            chat_id=chat_id,
+            group_id=group_id,
+            file_name=filename,
+            file_size=file_size,
+            sha256=sha256
+        )
+        open(upload.partial_path, 'wb').close()
+        db.session.add(upload)
+        db.session.commit()
+        
+        return jsonify({'success': True, 'upload': upload.to_dict()})
+        
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Upload init error: {str(e)}")
+        return jsonify({'success': False, 'message': 'خطا در شروع آپلود'})
+
+# وضعیت آپلود برای ادامه پس از قطع اتصال
+@app.route('/api/uploads/<upload_id>')
+@login_required
+def upload_status(upload_id):
+    upload = get_upload_session(upload_id)
+    if not upload:
+        return jsonify({'success': False, 'message': 'آپلود یافت نشد'})
+    return jsonify({'success': True, 'upload': upload.to_dict()})
+
+# بدنه درخواست بایت‌های خام تکه است و بلوک به بلوک روی فایل موقت نوشته می‌شود
+@app.route('/api/uploads/<upload_id>', methods=['PUT'])
+@login_required
+def upload_chunk(upload_id):
+    try:
+        upload = get_upload_session(upload_id)
+        if not upload:
+            return jsonify({'success': False, 'message': 'آپلود یافت نشد'})
+        
+        received = upload.received()
+        offset = request.args.get('offset', type=int)
+        length = request.content_length
+        
+        # offset بعد از داده دریافت شده یعنی تکه‌ای جا افتاده؛ کلاینت باید از offset برگشتی ادامه دهد
+        if offset is None or offset < 0 or offset > received:
+            return jsonify({'success': False, 'message': 'offset نامعتبر است', 'offset': received})
+        
+        if not length:
+            return jsonify({'success': False, 'message': 'تکه خالی است', 'offset': received})
+        
+        if offset + length > upload.file_size:
+            return jsonify({'success': False, 'message': 'حجم تکه بیشتر از فایل است', 'offset': received})
+        
+        written = 0
+        with open(upload.partial_path, 'r+b') as f:
+            f.seek(offset)
+            while written < length:
+                block = request.stream.read(min(UPLOAD_READ_BLOCK, length - written))
+                if not block:
+                    break
+                f.write(block)
+                written += len(block)
+        
+        # تکه ناقص (قطع اتصال) هم نگه داشته می‌شود؛ بایت‌های نوشته شده معتبرند
+        if written < length:
+            return jsonify({'success': False, 'message': 'تکه ناقص دریافت شد', 'offset': upload.received()})
+        
+        return jsonify({'success': True, 'offset': upload.received()})
+        
+    except Exception as e:
+        logger.error(f"Upload chunk error: {str(e)}")
+        return jsonify({'success': False, 'message': 'خطا در دریافت تکه'})
+
+@app.route('/api/uploads/<upload_id>/complete', methods=['POST'])
+@login_required
+def complete_upload(upload_id):
+    try:
+        user_id = session['user_id']
+        upload = get_upload_session(upload_id)
+        if not upload:
+            return jsonify({'success': False, 'message': 'آپلود یافت نشد'})
+        
+        data = request.get_json(silent=True) or {}
+        sha256 = (data.get('sha256') or upload.sha256 or '').lower()
+        if not SHA256_PATTERN.match(sha256):
+            return jsonify({'success': False, 'message': 'checksum نامعتبر است'})
+        
+        received = upload.received()
+        if received != upload.file_size:
+            return jsonify({'success': False, 'message': 'آپلود کامل نشده است', 'offset': received})
+        
+        # فایل خراب قابل ادامه نیست (محل خرابی معلوم نیست)؛ آپلود باید از ابتدا شروع شود
+        if file_sha256(upload.partial_path) != sha256:
+            discard_upload_session(upload)
+            db.session.commit()
+            return jsonify({'success': False, 'message': 'checksum فایل مطابقت ندارد'})
+        
+        # مقصد پیش از جابه‌جایی فایل بررسی می‌شود تا در صورت خطا فایل ناقص و جلسه آپلود برای تلاش دوباره بمانند
+        error = file_message_target_error(user_id, upload.chat_id, upload.group_id)
+        if error:
+            return jsonify({'success': False, 'message': error})
+        
+        partial_path = upload.partial_path
+        file_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{secrets.token_hex(8)}_{upload.file_name}")
+        os.replace(partial_path, file_path)
+        # حذف جلسه آپلود همراه پیام در یک commit ثبت می‌شود
+        db.session.delete(upload)
+        try:
+            response = create_file_message(user_id, upload.chat_id, upload.group_id, file_path, upload.file_name, upload.file_size)
+            if not response.get_json()['success']:
+                raise RuntimeError(response.get_json()['message'])
+        except Exception:
+            # ثبت پیام ناموفق بود: فایل به جای قبلی برمی‌گردد و جلسه آپلود (حذف commit نشده) باقی می‌ماند
+            db.session.rollback()
+            os.replace(file_path, partial_path)
+            raise
+        return response
+        
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Upload complete error: {str(e)}")
+        return jsonify({'success': False, 'message': 'خطا در آپلود فایل'})
+
+@app.route('/api/uploads/<upload_id>', methods=['DELETE'])
+@login_required
+def cancel_upload(upload_id):
+    try:
+        upload = get_upload_session(upload_id)
+        if not upload:
+            return jsonify({'success': False, 'message': 'آپلود یافت نشد'})
+        discard_upload_session(upload)
+        db.session.commit()
+        return jsonify({'success': True})
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Upload cancel error: {str(e)}")
+        return jsonify({'success': False})
+
 @app.route('/download/<int:message_id>')
 @login_required
 def download_file(message_id):
@@ -750,22 +2235,19 @@ def download_file(message_id):
         
         # پیدا کردن پیام
         message = Message.query.get(message_id)
-        if not message:
-            message = GroupMessage.query.get(message_id)
         
         if not message or not message.file_path:
             flash('فایل یافت نشد', 'error')
             return redirect('/chats')
         
         # بررسی دسترسی
-        if hasattr(message, 'chat_id'):  # پیام خصوصی
+        if message.chat_id is not None:  # پیام خصوصی
             chat = Chat.query.get(message.chat_id)
             if user_id not in [chat.user1_id, chat.user2_id]:
                 flash('دسترسی غیرمجاز', 'error')
                 return redirect('/chats')
         else:  # پیام گروهی
-            membership = GroupMember.query.filter_by(group_id=message.group_id, user_id=user_id).first()
-            if not membership:
+            if not is_group_member(message.group_id, user_id):
                 flash('دسترسی غیرمجاز', 'error')
                 return redirect('/chats')
         
@@ -778,30 +2260,39 @@ def download_file(message_id):
 
 @app.route('/api/get_new_messages/<int:chat_id>')
 @login_required
+@read_replica
 def get_new_messages(chat_id):
     try:
         user_id = session['user_id']
         
         # بررسی دسترسی به چت
-        chat = Chat.query.get(chat_id)
-        if not chat or user_id not in [chat.user1_id, chat.user2_id]:
+        participants = chat_participants(chat_id)
+        if not participants or user_id not in participants:
             return jsonify({'success': False, 'message': 'دسترسی غیرمجاز'})
         
+        # پاسخ 304 در صورت عدم تغییر از آخرین دریافت
+        wire_format = message_wire_format()
+        typing = typing_names(chat_conversation_id(chat_id), user_id)
+        version = chat_version(chat_id)
+        etag = make_poll_etag('chat', chat_id, user_id, wire_format, typing, *version)
+        if request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
+        
         # دریافت پیام‌های جدید
-        messages = Message.query.filter_by(chat_id=chat_id).order_by(Message.timestamp.asc()).all()
+        messages = conversation_messages(chat_conversation_id(chat_id), version, request.args.get('after', type=int))
         
         # علامت‌گذاری پیام‌های دریافتی به عنوان تحویل شده و خوانده شده
-        other_user_id = chat.get_other_user(user_id)
-        undelivered_messages = Message.query.filter_by(chat_id=chat_id, delivered=False).all()
-        unread_messages = Message.query.filter_by(chat_id=chat_id, sender_id=other_user_id, read=False).all()
-        
-        for msg in undelivered_messages:
-            msg.delivered = True
-        
-        for msg in unread_messages:
-            msg.read = True
-        
-        db.session.commit()
+        other_user_id = participants[0] if participants[1] == user_id else participants[1]
+        version = mark_chat_receipts(chat_id, user_id, other_user_id, messages, version)
+        
+        if wire_format != 'json':
+            payload = message_columns(messages, user_id, receipts=True)
+            payload['typing'] = typing
+            response = compact_messages_response(payload, wire_format)
+            response.set_etag(make_poll_etag('chat', chat_id, user_id, wire_format, typing, *version), weak=True)
+            response.headers['Cache-Control'] = 'no-cache, private'
+            response.vary.add('Accept')
+            return response
         
         messages_data = []
         for msg in messages:
@@ -819,7 +2310,11 @@ def get_new_messages(chat_id):
                 'file_size': msg.file_size
             })
         
-        return jsonify({'success': True, 'messages': messages_data})
+        response = jsonify({'success': True, 'messages': messages_data, 'typing': typing})
+        response.set_etag(make_poll_etag('chat', chat_id, user_id, wire_format, typing, *version), weak=True)
+        response.headers['Cache-Control'] = 'no-cache, private'
+        response.vary.add('Accept')
+        return response
         
     except Exception as e:
         logger.error(f"Get messages error: {str(e)}")
@@ -827,25 +2322,38 @@ def get_new_messages(chat_id):
 
 @app.route('/api/get_new_group_messages/<group_id>')
 @login_required
+@read_replica
 def get_new_group_messages(group_id):
     try:
         user_id = session['user_id']
         
         # بررسی عضویت در گروه
-        membership = GroupMember.query.filter_by(group_id=group_id, user_id=user_id).first()
-        if not membership:
+        if not is_group_member(group_id, user_id):
             return jsonify({'success': False, 'message': 'شما عضو این گروه نیستید'})
         
+        # پاسخ 304 در صورت عدم تغییر از آخرین دریافت
+        wire_format = message_wire_format()
+        typing = typing_names(group_conversation_id(group_id), user_id)
+        version = group_version(group_id)
+        etag = make_poll_etag('group', group_id, user_id, wire_format, typing, *version)
+        if request.if_none_match.contains_weak(etag):
+            return not_modified(etag)
+        
         # دریافت پیام‌های جدید
-        messages = GroupMessage.query.filter_by(group_id=group_id).order_by(GroupMessage.timestamp.asc()).all()
+        messages = conversation_messages(group_conversation_id(group_id), version, request.args.get('after', type=int))
         
         # آپدیت خوانده شدن پیام‌ها
-        for message in messages:
-            read_by = json.loads(message.read_by)
-            if user_id not in read_by:
-                read_by.append(user_id)
-                message.read_by = json.dumps(read_by)
-        db.session.commit()
+        mark_group_read(group_id, user_id, messages)
+        
+        # پس از علامت‌گذاری بالا همه پیام‌ها برای این کاربر خوانده شده‌اند، پس ستون read لازم نیست
+        if wire_format != 'json':
+            payload = message_columns(messages, user_id)
+            payload['typing'] = typing
+            response = compact_messages_response(payload, wire_format)
+            response.set_etag(etag, weak=True)
+            response.headers['Cache-Control'] = 'no-cache, private'
+            response.vary.add('Accept')
+            return response
         
         messages_data = []
         for msg in messages:
@@ -863,12 +2371,172 @@ def get_new_group_messages(group_id):
                 'file_size': msg.file_size
             })
         
-        return jsonify({'success': True, 'messages': messages_data})
+        response = jsonify({'success': True, 'messages': messages_data, 'typing': typing})
+        response.set_etag(etag, weak=True)
+        response.headers['Cache-Control'] = 'no-cache, private'
+        response.vary.add('Accept')
+        return response
         
     except Exception as e:
         logger.error(f"Get group messages error: {str(e)}")
         return jsonify({'success': False, 'message': 'خطا در دریافت پیام‌ها'})
 
+# ==================== Inbox sync ====================
+
+def sync_message_to_dict(msg, user_id):
+    message = {
+        'id': msg.id,
+        'conversation_id': msg.conversation_id,
+        'chat_id': msg.chat_id,
+        'group_id': msg.group_id,
+        'content': msg.content,
+        'sender_id': msg.sender_id,
+        'sender_name': msg.sender_name,
+        'timestamp': msg.timestamp.strftime('%H:%M'),
+        'is_me': msg.sender_id == user_id,
+        'message_type': msg.message_type,
+        'file_name': msg.file_name,
+        'file_size': msg.file_size
+    }
+    if msg.chat_id is not None:
+        message['read'] = msg.read
+        message['delivered'] = msg.delivered
+    else:
+        message['read'] = user_id in json.loads(msg.read_by)
+    return message
+
+# عنوان مکالمه‌های جدید برای افزودن به صندوق (نام طرف مقابل یا نام گروه)
+def conversation_titles(conversation_ids, user_id):
+    titles = {}
+    chat_others = {}
+    group_ids = []
+    for conversation_id in conversation_ids:
+        kind, _, key = conversation_id.partition(':')
+        if kind == 'chat':
+            participants = chat_participants(int(key))
+            if participants:
+                chat_others[conversation_id] = participants[0] if participants[1] == user_id else participants[1]
+        else:
+            group_ids.append(key)
+    if chat_others:
+        others = user_views(chat_others.values())
+        for conversation_id, other_user_id in chat_others.items():
+            other_user = others.get(other_user_id)
+            titles[conversation_id] = {'title': other_user.name if other_user else '', 'other_user_id': other_user_id}
+    if group_ids:
+        for group_id, name in db.session.query(Group.group_id, Group.name).filter(Group.group_id.in_(group_ids)).all():
+            titles[group_conversation_id(group_id)] = {'title': name}
+    return titles
+
+# همگام‌سازی کل صندوق کاربر از یک cursor: پیام‌های جدید همه چت‌ها و گروه‌ها، رسیدها و ترتیب جدید صندوق
+# فقط از فید همین کاربر خوانده می‌شود (بدون پیمایش تک‌تک مکالمه‌ها). بدون cursor فقط cursor فعلی برگردانده می‌شود.
+@app.route('/api/sync')
+@login_required
+@read_replica
+def sync():
+    try:
+        user_id = session['user_id']
+        cursor = request.args.get('cursor', type=int)
+        prune_user_changes()
+        
+        if cursor is None:
+            return jsonify({'success': True, 'cursor': current_sync_cursor()})
+        
+        # cursor قدیمی‌تر از قدیمی‌ترین ردیف نگه‌داری شده: ممکن است تغییراتی حذف شده باشد و کلاینت باید از نو بارگذاری کند
+        oldest = db.session.query(db.func.min(UserChange.id)).scalar()
+        if oldest is not None and cursor < oldest - 1:
+            return jsonify({'success': True, 'reset': True, 'cursor': current_sync_cursor()})
+        
+        # شناسه‌های فید به ترتیب commit ساخته می‌شوند (lock_user_change_feed)، پس ردیفی با شناسه کوچک‌تر از cursor
+        # بعداً ظاهر نمی‌شود و cursor تا آخرین ردیف برگردانده شده جلو می‌رود
+        feed_condition = user_feed_condition(user_id)
+        
+        def load_changes():
+            return (UserChange.query
+                    .filter(feed_condition, UserChange.id > cursor)
+                    .order_by(UserChange.id.asc())
+                    .limit(SYNC_BATCH_SIZE + 1)
+                    .all())
+        
+        # long-poll اختیاری (?wait=ثانیه، حداکثر SYNC_MAX_WAIT): بدون تغییر، درخواست تا سیگنال بعدی باس (پیام، رسید،
+        # تایپ در هر worker) منتظر می‌ماند و فید دوباره خوانده می‌شود؛ اتصال دیتابیس در حین انتظار آزاد است
+        wait = min(max(request.args.get('wait', 0, type=float), 0), app.config['SYNC_MAX_WAIT'])
+        deadline = time.monotonic() + wait
+        sequence = signal_bus.sequence
+        changes = load_changes()
+        while not changes and time.monotonic() < deadline:
+            db.session.rollback()
+            sequence = signal_bus.wait(sequence, deadline - time.monotonic())
+            changes = load_changes()
+        has_more = len(changes) > SYNC_BATCH_SIZE
+        changes = changes[:SYNC_BATCH_SIZE]
+        
+        message_ids = {}
+        receipts = {}
+        seen = {}
+        touched = []
+        for change in changes:
+            if change.kind == 'message':
+                message_ids.setdefault(change.conversation_id, []).append(change.message_id)
+            elif change.kind in ('delivered', 'read'):
+                key = (change.conversation_id, change.kind)
+                receipts[key] = max(receipts.get(key, 0), change.message_id)
+            elif change.kind == 'seen':
+                seen[change.conversation_id] = max(seen.get(change.conversation_id, 0), change.message_id)
+            if change.kind in ('message', 'conversation'):
+                if change.conversation_id in touched:
+                    touched.remove(change.conversation_id)
+                touched.append(change.conversation_id)
+        
+        # پیام‌ها با یک کوئری برای هر شارد درگیر خوانده می‌شوند
+        messages = []
+        if message_ids:
+            all_ids = [message_id for ids in message_ids.values() for message_id in ids]
+            messages = message_views(Message.conversation_id.in_(list(message_ids)), Message.id.in_(all_ids))
+            # نتایج چند شارد پشت سر هم ادغام می‌شوند، پس ترتیب کلی دوباره ساخته می‌شود
+            messages.sort(key=lambda msg: msg.id)
+        messages_data = [sync_message_to_dict(msg, user_id) for msg in messages]
+        
+        last_messages = {}
+        new_counts = {}
+        for message in messages_data:
+            last_messages[message['conversation_id']] = message
+            if not message['is_me']:
+                new_counts[message['conversation_id']] = new_counts.get(message['conversation_id'], 0) + 1
+        
+        # صندوق: مکالمه‌های تغییر کرده به ترتیب جدیدترین
+        titles = conversation_titles(touched, user_id)
+        inbox = []
+        for conversation_id in reversed(touched):
+            last_message = last_messages.get(conversation_id)
+            entry = {
+                'conversation_id': conversation_id,
+                'new_messages': new_counts.get(conversation_id, 0),
+                'last_message': {
+                    'content': last_message['content'],
+                    'timestamp': last_message['timestamp'],
+                    'is_me': last_message['is_me'],
+                    'sender_name': last_message['sender_name']
+                } if last_message else None
+            }
+            entry.update(titles.get(conversation_id, {}))
+            inbox.append(entry)
+        
+        return jsonify({
+            'success': True,
+            'cursor': changes[-1].id if changes else cursor,
+            'has_more': has_more,
+            'messages': messages_data,
+            'receipts': [{'conversation_id': conversation_id, 'state': state, 'up_to': message_id}
+                         for (conversation_id, state), message_id in receipts.items()],
+            'seen': [{'conversation_id': conversation_id, 'up_to': message_id} for conversation_id, message_id in seen.items()],
+            'inbox': inbox
+        })
+        
+    except Exception as e:
+        logger.error(f"Sync error: {str(e)}")
+        return jsonify({'success': False, 'message': 'خطا در همگام‌سازی'})
+
 @app.route('/start_chat', methods=['POST'])
 @login_required
 def start_chat():
@@ -880,15 +2548,19 @@ def start_chat():
             flash('لطفاً شناسه کاربری را وارد کنید', 'error')
             return redirect('/chats')
         
-        if other_user_id == user_id:
-            flash('نمی‌توانید با خودتان چت کنید', 'error')
-            return redirect('/chats')
-        
-        # بررسی وجود کاربر
+        # بررسی وجود کاربر (شماره تلفن کامل هم به جای شناسه پذیرفته می‌شود)
         other_user = User.query.filter_by(user_id=other_user_id).first()
+        if not other_user:
+            phones = phone_prefixes(other_user_id)
+            other_user = User.query.filter(User.phone.in_(phones)).first() if phones else None
         if not other_user:
             flash('کاربری با این شناسه یافت نشد', 'error')
             return redirect('/chats')
+        other_user_id = other_user.user_id
+        
+        if other_user_id == user_id:
+            flash('نمی‌توانید با خودتان چت کنید', 'error')
+            return redirect('/chats')
         
         # پیدا کردن یا ایجاد چت
         chat = Chat.query.filter(
@@ -899,6 +2571,9 @@ def start_chat():
         if not chat:
             chat = Chat(user1_id=user_id, user2_id=other_user_id)
             db.session.add(chat)
+            db.session.flush()
+            db.session.add(ConversationState(conversation_id=chat_conversation_id(chat.id)))
+            record_changes([user_id, other_user_id], 'conversation', chat_conversation_id(chat.id))
             db.session.commit()
         
         logger.info(f"Chat started: {user_id} -> {other_user_id}")
@@ -909,6 +2584,72 @@ def start_chat():
         flash('خطا در شروع چت', 'error')
         return redirect('/chats')
 
+# ==================== User directory search ====================
+
+USER_SEARCH_LIMIT = 10
+USER_SEARCH_MIN_PHONE_DIGITS = 4
+PERSIAN_DIGITS = str.maketrans('۰۱۲۳۴۵۶۷۸۹٠١٢٣٤٥٦٧٨٩', '01234567890123456789')
+USER_ID_PREFIX_PATTERN = re.compile(r'^[0-9A-F]{2,10}$')
+
+# شرط پیشوندی قابل استفاده از ایندکس B-tree در SQLite و PostgreSQL:
+# بازه [prefix, prefix بعدی) روی ایندکس پیمایش می‌شود و LIKE فقط ردیف‌های همان بازه را دقیق فیلتر می‌کند
+def prefix_condition(column, prefix):
+    upper_bound = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return db.and_(column >= prefix, column < upper_bound, column.startswith(prefix, autoescape=True))
+
+# شماره‌های واردشده با ارقام فارسی، فاصله، خط تیره یا پیش‌شماره +98 هم پیدا می‌شوند
+def phone_prefixes(query):
+    digits = re.sub(r'[\s\-()]', '', query.translate(PERSIAN_DIGITS))
+    if not re.fullmatch(r'\+?\d+', digits):
+        return []
+    prefixes = [digits]
+    for country_code in ('+98', '0098', '98'):
+        if digits.startswith(country_code) and len(digits) > len(country_code):
+            prefixes.append('0' + digits[len(country_code):])
+            break
+    return [prefix for prefix in prefixes if len(prefix.lstrip('+')) >= USER_SEARCH_MIN_PHONE_DIGITS]
+
+def search_users(query, exclude_user_id, limit=USER_SEARCH_LIMIT):
+    results = {}
+    searches = [('name', prefix_condition(db.func.lower(User.name), query.lower()), db.func.lower(User.name))]
+    if USER_ID_PREFIX_PATTERN.match(query.upper()):
+        searches.append(('user_id', prefix_condition(User.user_id, query.upper()), User.user_id))
+    for prefix in phone_prefixes(query):
+        searches.append(('phone', prefix_condition(User.phone, prefix), User.phone))
+    
+    for matched, condition, order in searches:
+        users = (db.session.query(User.user_id, User.name, User.is_online, User.last_seen)
+                 .filter(condition, User.is_active == True, User.user_id != exclude_user_id)
+                 .order_by(order)
+                 .limit(limit)
+                 .all())
+        for user in users:
+            if user.user_id not in results:
+                results[user.user_id] = {
+                    'user_id': user.user_id,
+                    'name': user.name,
+                    'is_online': user.is_online,
+                    'last_seen': user.last_seen.strftime('%H:%M') if user.last_seen else 'آنلاین',
+                    'matched': matched
+                }
+    return list(results.values())[:limit]
+
+# جستجوی کاربران با پیشوند نام، شماره تلفن یا شناسه کاربری (برای پیشنهاد هنگام تایپ)
+# شماره تلفن کاربران در نتیجه برگردانده نمی‌شود.
+@app.route('/api/users/search')
+@login_required
+@read_replica
+def user_search():
+    try:
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({'success': True, 'users': []})
+        limit = min(max(request.args.get('limit', USER_SEARCH_LIMIT, type=int), 1), USER_SEARCH_LIMIT)
+        return jsonify({'success': True, 'users': search_users(query[:100], session['user_id'], limit)})
+    except Exception as e:
+        logger.error(f"User search error: {str(e)}")
+        return jsonify({'success': False, 'message': 'خطا در جستجو'})
+
 # ==================== Admin Routes ====================
 
 @app.route('/admin_login', methods=['GET', 'POST'])
@@ -917,7 +2658,12 @@ def admin_login():
         username = request.form.get('username', '').strip()
         password = request.form.get('password', '').strip()
         
-        if username == ADMIN_USERNAME and check_password_hash(ADMIN_PASSWORD_HASH, password):
+        try:
+            password_valid = password_hasher.verify(ADMIN_PASSWORD_HASH, password)
+        except HashingBusy:
+            password_valid = False
+        
+        if username == ADMIN_USERNAME and password_valid:
             session['is_admin'] = True
             session.permanent = True
             flash('ورود به پنل مدیریت موفقیت‌آمیز بود', 'success')
@@ -931,24 +2677,34 @@ def admin_login():
 
 @app.route('/admin_dashboard')
 @admin_required
+@read_replica
 def admin_dashboard():
     try:
-        users = User.query.order_by(User.registration_date.desc()).all()
-        messages = MessageLog.query.order_by(MessageLog.timestamp.desc()).limit(100).all()
-        chats = Chat.query.all()
-        groups = Group.query.all()
+        # فقط ستون‌های نمایش داده شده؛ چت‌ها و گروه‌ها فقط شمرده می‌شوند
+        users = db.session.execute(
+            db.select(User.id, User.name, User.phone, User.user_id, User.is_online, User.registration_date)
+            .order_by(User.registration_date.desc())
+        ).all()
+        messages = db.session.execute(
+            db.select(MessageLog.sender_name, MessageLog.sender_id, MessageLog.content, MessageLog.timestamp)
+            .order_by(MessageLog.timestamp.desc())
+            .limit(100)
+        ).all()
+        total_chats = db.session.execute(db.select(db.func.count(Chat.id))).scalar()
+        total_groups = db.session.execute(db.select(db.func.count(Group.id))).scalar()
         
         # آمار پیشرفته
         online_users = User.query.filter_by(is_online=True).count()
         today = datetime.now(timezone.utc).date()
         today_users = User.query.filter(db.func.date(User.registration_date) == today).count()
-        total_messages = Message.query.count() + GroupMessage.query.count()
+        # count روی نتیجه ادغام‌شده شاردها فقط عدد شارد اول را می‌دهد؛ هر شارد جدا شمرده می‌شود
+        total_messages = sum(db.session.query(db.func.count(Message.id)).options(set_shard_id(shard)).scalar() for shard in shard_router.shards)
         
         stats = {
             'total_users': len(users),
             'total_messages': total_messages,
-            'total_chats': len(chats),
-            'total_groups': len(groups),
+            'total_chats': total_chats,
+            'total_groups': total_groups,
             'online_users': online_users,
             'today_users': today_users
         }
@@ -956,14 +2712,214 @@ def admin_dashboard():
         return render_template('admin_dashboard.html',
                              users=users,
                              messages=messages,
-                             chats=chats,
-                             groups=groups,
                              stats=stats)
                              
     except Exception as e:
         logger.error(f"Admin dashboard error: {str(e)}")
         flash('خطا در بارگذاری پنل مدیریت', 'error')
-        return render_template('admin_dashboard.html', users=[], messages=[], chats=[], groups=[], stats={})
+        return render_template('admin_dashboard.html', users=[], messages=[], stats={})
+
+# ==================== Admin message log ====================
+
+MESSAGE_LOG_PAGE_SIZE = 50
+MESSAGE_LOG_MAX_PAGE_SIZE = 500
+MESSAGE_LOG_CSV_BATCH = 1000
+MESSAGE_LOG_CSV_COLUMNS = ['id', 'timestamp', 'message_type', 'message_type_detail', 'sender_id',
+                           'sender_name', 'receiver_id', 'content', 'ip_address']
+
+def parse_log_time(value):
+    if not value:
+        return None
+    return datetime.fromisoformat(value)
+
+# فیلترهای لاگ از query string؛ ValueError برای زمان نامعتبر
+def message_log_filters(args):
+    filters = {
+        'sender_id': args.get('sender_id', '').strip().upper(),
+        'receiver_id': args.get('receiver_id', '').strip().upper(),
+        'type': args.get('type', '').strip(),
+        'since': args.get('since', '').strip(),
+        'until': args.get('until', '').strip()
+    }
+    conditions = []
+    if filters['sender_id']:
+        conditions.append(MessageLog.sender_id == filters['sender_id'])
+    if filters['receiver_id']:
+        conditions.append(MessageLog.receiver_id == filters['receiver_id'])
+    if filters['type']:
+        conditions.append(MessageLog.message_type == filters['type'])
+    since = parse_log_time(filters['since'])
+    if since:
+        conditions.append(MessageLog.timestamp >= since)
+    until = parse_log_time(filters['until'])
+    if until:
+        conditions.append(MessageLog.timestamp < until)
+    return filters, conditions
+
+# صفحه‌بندی keyset: جدیدترین اول، cursor همان id آخرین ردیف صفحه قبل است
+def message_log_page(conditions, before_id=None, limit=MESSAGE_LOG_PAGE_SIZE):
+    statement = db.select(*(getattr(MessageLog, column) for column in MESSAGE_LOG_CSV_COLUMNS)).where(*conditions)
+    if before_id:
+        statement = statement.where(MessageLog.id < before_id)
+    rows = db.session.execute(statement.order_by(MessageLog.id.desc()).limit(limit + 1)).all()
+    next_cursor = rows[limit - 1].id if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+def message_log_to_dict(log):
+    return {
+        'id': log.id,
+        'timestamp': log.timestamp.strftime('%Y-%m-%d %H:%M:%S'),
+        'message_type': log.message_type,
+        'message_type_detail': log.message_type_detail,
+        'sender_id': log.sender_id,
+        'sender_name': log.sender_name,
+        'receiver_id': log.receiver_id,
+        'content': log.content,
+        'ip_address': log.ip_address
+    }
+
+@app.route('/admin/message_logs')
+@admin_required
+@read_replica
+def admin_message_logs():
+    try:
+        filters, conditions = message_log_filters(request.args)
+    except ValueError:
+        flash('بازه زمانی نامعتبر است', 'error')
+        return redirect('/admin/message_logs')
+    
+    logs, next_cursor = message_log_page(conditions, request.args.get('before', type=int))
+    active_filters = {key: value for key, value in filters.items() if value}
+    
+    return render_template('admin_message_logs.html',
+                         logs=logs,
+                         filters=filters,
+                         next_url=url_for('admin_message_logs', before=next_cursor, **active_filters) if next_cursor else None,
+                         csv_url=url_for('admin_message_logs_csv', **active_filters))
+
+@app.route('/admin/api/message_logs')
+@admin_required
+@read_replica
+def admin_message_logs_api():
+    try:
+        _, conditions = message_log_filters(request.args)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'بازه زمانی نامعتبر است'})
+    
+    limit = min(request.args.get('limit', MESSAGE_LOG_PAGE_SIZE, type=int), MESSAGE_LOG_MAX_PAGE_SIZE)
+    logs, next_cursor = message_log_page(conditions, request.args.get('before', type=int), max(limit, 1))
+    
+    return jsonify({
+        'success': True,
+        'logs': [message_log_to_dict(log) for log in logs],
+        'next_cursor': next_cursor
+    })
+
+# خروجی CSV به صورت stream و دسته‌ای (keyset) تا کل نتیجه در حافظه نگه داشته نشود
+@app.route('/admin/message_logs.csv')
+@admin_required
+@read_replica
+def admin_message_logs_csv():
+    try:
+        _, conditions = message_log_filters(request.args)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'بازه زمانی نامعتبر است'})
+    
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(MESSAGE_LOG_CSV_COLUMNS)
+        before_id = None
+        while True:
+            logs, next_cursor = message_log_page(conditions, before_id, MESSAGE_LOG_CSV_BATCH)
+            for log in logs:
+                row = message_log_to_dict(log)
+                writer.writerow([row[column] for column in MESSAGE_LOG_CSV_COLUMNS])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+            db.session.expunge_all()
+            if not next_cursor:
+                break
+            before_id = next_cursor
+    
+    filename = f"message_logs_{datetime.now(timezone.utc).strftime('%Y%m%d_%H%M%S')}.csv"
+    return Response(stream_with_context(generate()),
+                    mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+# آمار کش‌های درون‌حافظه همین worker (هر worker کش جداگانه دارد)
+@app.route('/admin/api/cache_stats')
+@admin_required
+def admin_cache_stats_api():
+    return jsonify({
+        'success': True,
+        'worker': os.getpid(),
+        'hot_messages': hot_messages.stats(),
+        'membership_index': membership_index.stats()
+    })
+
+# ==================== Admin request profiles ====================
+
+@app.route('/admin/profiles')
+@admin_required
+def admin_profiles():
+    return render_template('admin_profiles.html',
+                         profiles=profile_store.list(),
+                         settings=profiling_settings,
+                         max_profiles=app.config['PROFILE_MAX'])
+
+@app.route('/admin/profiles/settings', methods=['POST'])
+@admin_required
+def admin_profile_settings():
+    try:
+        settings = {
+            'slow_ms': max(int(request.form.get('slow_ms') or 0), 0),
+            'sample_rate': min(max(float(request.form.get('sample_percent') or 0) / 100, 0.0), 1.0),
+            'path_prefix': request.form.get('path_prefix', '').strip(),
+            'user_id': request.form.get('user_id', '').strip().upper()
+        }
+    except ValueError:
+        flash('مقادیر تنظیمات نامعتبر است', 'error')
+        return redirect('/admin/profiles')
+    
+    try:
+        setting = AppSetting.query.get(PROFILING_SETTINGS_KEY) or AppSetting(key=PROFILING_SETTINGS_KEY)
+        setting.value = json.dumps(settings)
+        db.session.add(setting)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Profiling settings save error: {str(e)}")
+        flash('خطا در ذخیره تنظیمات پروفایل', 'error')
+        return redirect('/admin/profiles')
+    
+    profiling_settings.update(settings)
+    publish_event(events.PROFILING_CHANGED)
+    logger.info(f"Admin updated profiling settings: {settings}")
+    flash('تنظیمات پروفایل ذخیره شد', 'success')
+    return redirect('/admin/profiles')
+
+@app.route('/admin/profiles/<profile_id>')
+@admin_required
+def admin_profile(profile_id):
+    profile = profile_store.get(profile_id)
+    if not profile:
+        flash('پروفایل یافت نشد', 'error')
+        return redirect('/admin/profiles')
+    return render_template('admin_profile.html', profile=profile)
+
+# دانلود فایل پروفایل: json (متادیتا و timeline SQL)، prof (pstats برای snakeviz) یا folded (flamegraph.pl / speedscope)
+@app.route('/admin/profiles/<profile_id>/<kind>')
+@admin_required
+def admin_profile_file(profile_id, kind):
+    path = profile_store.path(profile_id, kind)
+    if not path:
+        abort(404)
+    return send_file(os.path.abspath(path),
+                     mimetype=profiling.PROFILE_FILES[kind],
+                     as_attachment=True,
+                     download_name=f'{profile_id}.{kind}')
 
 @app.route('/admin/delete_user/<int:user_id>')
 @admin_required
@@ -979,6 +2935,7 @@ def delete_user(user_id):
             user.is_online = False
             
             db.session.commit()
+            publish_signal(events.USER_CHANGED, user_id=user.user_id)
             
             flash(f'کاربر {user_info} با موفقیت غیرفعال شد', 'success')
             logger.info(f"Admin disabled user: {user_info}")
@@ -1001,6 +2958,7 @@ def activate_user(user_id):
         if user:
             user.is_active = True
             db.session.commit()
+            publish_signal(events.USER_CHANGED, user_id=user.user_id)
             
             flash(f'کاربر {user.name} با موفقیت فعال شد', 'success')
             logger.info(f"Admin activated user: {user.name}")
@@ -1024,6 +2982,7 @@ def logout():
                 user.last_seen = datetime.now(timezone.utc)
                 user.is_online = False
                 db.session.commit()
+                publish_signal(events.USER_CHANGED, user_id=user.user_id)
                 logger.info(f"User logged out: {user.name} ({user.user_id})")
     except Exception as e:
         logger.error(f"Logout error: {str(e)}")
@@ -1048,8 +3007,41 @@ def update_online_status():
             user.last_seen = datetime.now(timezone.utc)
             user.is_online = True
             db.session.commit()
+            publish_signal(events.USER_CHANGED, user_id=user_id)
+        return jsonify({'success': True})
+    except Exception as e:
+        return jsonify({'success': False})
+
+# API برای وضعیت «در حال نوشتن…» (بدون هیچ نوشتنی در دیتابیس)
+@app.route('/api/typing', methods=['POST'])
+@login_required
+def update_typing():
+    try:
+        user_id = session['user_id']
+        data = request.get_json(silent=True) or {}
+        chat_id = data.get('chat_id')
+        group_id = data.get('group_id')
+        
+        if chat_id:
+            participants = chat_participants(int(chat_id))
+            if not participants or user_id not in participants:
+                return jsonify({'success': False, 'message': 'دسترسی غیرمجاز'})
+            conversation_id = chat_conversation_id(int(chat_id))
+        elif group_id:
+            if not is_group_member(group_id, user_id):
+                return jsonify({'success': False, 'message': 'شما عضو این گروه نیستید'})
+            conversation_id = group_conversation_id(group_id)
+        else:
+            return jsonify({'success': False, 'message': 'مقصد مشخص نیست'})
+        
+        publish_signal(events.TYPING_CHANGED,
+                      conversation_id=conversation_id,
+                      user_id=user_id,
+                      name=session['name'],
+                      typing=bool(data.get('typing', True)))
         return jsonify({'success': True})
     except Exception as e:
+        logger.error(f"Typing update error: {str(e)}")
         return jsonify({'success': False})
 
 # خطای 404
@@ -0,0 +1,225 @@
+const { chatId, userId, otherUserId, pollOverlap } = window.CHAT_CONFIG;
+
+// اسکرول به پایین
+function scrollToBottom() {
+    const container = document.getElementById('messagesContainer');
+    container.scrollTop = container.scrollHeight;
+}
+
+// ارسال پیام
+function sendMessage() {
+    const messageInput = document.getElementById('messageInput');
+    const sendButton = document.getElementById('sendButton');
+    const content = messageInput.value.trim();
+    
+    if (!content) return;
+    
+    // غیرفعال کردن دکمه
+    sendButton.disabled = true;
+    sendButton.innerHTML = '<i class="fas fa-spinner fa-spin"></i>';
+    
+    fetch('/api/send_message', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({
+            chat_id: chatId,
+            content: content
+        })
+    })
+    .then(response => response.json())
+    .then(data => {
+        if (data.success) {
+            addMessageToChat(data.message);
+            messageInput.value = '';
+            // سرور با ارسال پیام وضعیت نوشتن را پاک می‌کند
+            lastTypingSent = 0;
+            scrollToBottom();
+        } else {
+            alert(data.message || 'خطا در ارسال پیام');
+        }
+    })
+    .catch(error => {
+        console.error('Error:', error);
+        alert('خطا در ارسال پیام');
+    })
+    .finally(() => {
+        // فعال کردن دکمه
+        sendButton.disabled = false;
+        sendButton.innerHTML = '<i class="fas fa-paper-plane"></i>';
+    });
+}
+
+// اضافه کردن پیام به چت
+function addMessageToChat(message) {
+    const messagesContainer = document.getElementById('messagesContainer');
+    const emptyChat = messagesContainer.querySelector('.empty-chat');
+    
+    // حذف حالت خالی اگر وجود دارد
+    if (emptyChat) {
+        emptyChat.remove();
+    }
+    
+    const messageDiv = document.createElement('div');
+    messageDiv.className = `message message-sent`;
+    messageDiv.dataset.messageId = message.id;
+    messageDiv.innerHTML = `
+        <div class="message-content">${message.content}</div>
+        <div class="message-time">
+            ${message.timestamp}
+            <i class="fas fa-check message-status"></i>
+        </div>
+    `;
+    messagesContainer.appendChild(messageDiv);
+}
+
+// ارسال با Enter
+function handleKeyPress(event) {
+    if (event.key === 'Enter' && !event.shiftKey) {
+        event.preventDefault();
+        sendMessage();
+    }
+}
+
+// نسخه آخرین پاسخ دریافتی برای درخواست شرطی
+let messagesEtag = null;
+
+// cursor دریافت: بزرگ‌ترین شناسه‌ای که از سرور دریافت شده (شناسه‌ها زمان‌مرتب هستند).
+// پیام‌های ارسالی خود کاربر cursor را جلو نمی‌برند تا پیام‌های هم‌زمان طرف مقابل از دست نروند.
+// شناسه هنگام flush ساخته می‌شود و پیامی با شناسه کوچک‌تر ممکن است دیرتر commit شود، پس هر poll
+// بازه pollOverlap (شناسه‌های چند ثانیه اخیر) زیر cursor را دوباره می‌گیرد؛ تکراری‌ها با data-message-id کنار گذاشته می‌شوند.
+let lastMessageId = 0;
+
+// ارسال وضعیت «در حال نوشتن…» حداکثر هر TYPING_THROTTLE_MS یک بار (TTL سرور کمی بیشتر است)
+const TYPING_THROTTLE_MS = 3000;
+let lastTypingSent = 0;
+
+function notifyTyping(typing) {
+    const now = Date.now();
+    if (typing && now - lastTypingSent < TYPING_THROTTLE_MS) return;
+    if (!typing && !lastTypingSent) return;
+    lastTypingSent = typing ? now : 0;
+    
+    fetch('/api/typing', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({
+            chat_id: chatId,
+            typing: typing
+        })
+    }).catch(() => {});
+}
+
+function showTyping(names) {
+    const indicator = document.getElementById('typingIndicator');
+    indicator.style.display = names && names.length ? 'flex' : 'none';
+}
+
+// تبدیل پاسخ ستونی سرور به لیست پیام‌ها (زمان‌ها epoch میلی‌ثانیه و به وقت UTC نمایش داده می‌شوند)
+function decodeMessageColumns(data) {
+    const columns = data.columns;
+    return columns.id.map((id, i) => ({
+        id: id,
+        content: columns.content[i],
+        sender_id: data.sender_ids[columns.sender[i]],
+        sender_name: data.sender_names[columns.sender[i]],
+        timestamp: new Date(columns.ts[i]).toISOString().substring(11, 16),
+        is_me: columns.sender[i] === data.me,
+        read: columns.read ? columns.read[i] : true,
+        delivered: columns.delivered ? columns.delivered[i] : true,
+        message_type: columns.message_type[i],
+        file_name: columns.file_name[i],
+        file_size: columns.file_size[i]
+    }));
+}
+
+// دریافت پیام‌های جدید
+function getNewMessages() {
+    const headers = messagesEtag ? { 'If-None-Match': messagesEtag } : {};
+    fetch(`/api/get_new_messages/${chatId}?after=${Math.max(lastMessageId - pollOverlap, 0)}&format=columns`, { headers: headers })
+        .then(response => {
+            if (response.status === 304) return null;
+            messagesEtag = response.headers.get('ETag');
+            return response.json();
+        })
+        .then(data => {
+            if (data && data.success) {
+                const messages = decodeMessageColumns(data);
+                const messagesContainer = document.getElementById('messagesContainer');
+                const currentMessageIds = new Set(
+                    Array.from(messagesContainer.querySelectorAll('.message'))
+                        .map(msg => msg.dataset.messageId)
+                        .filter(id => id)
+                );
+                
+                let newMessagesAdded = false;
+                
+                messages.forEach(message => {
+                    lastMessageId = Math.max(lastMessageId, message.id);
+                    if (!currentMessageIds.has(message.id.toString())) {
+                        const messageDiv = document.createElement('div');
+                        messageDiv.className = `message ${message.is_me ? 'message-sent' : 'message-received'}`;
+                        messageDiv.dataset.messageId = message.id;
+                        messageDiv.innerHTML = `
+                            <div class="message-content">${message.content}</div>
+                            <div class="message-time">
+                                ${message.timestamp}
+                                ${message.is_me ? (message.read ? '<i class="fas fa-check-double text-info message-status"></i>' : '<i class="fas fa-check message-status"></i>') : ''}
+                            </div>
+                        `;
+                        messagesContainer.appendChild(messageDiv);
+                        newMessagesAdded = true;
+                    }
+                });
+                
+                if (newMessagesAdded) {
+                    scrollToBottom();
+                }
+                
+                showTyping(data.typing);
+            }
+        })
+        .catch(error => console.error('Error:', error));
+}
+
+// آپدیت وضعیت آنلاین
+function updateOnlineStatus() {
+    fetch('/api/update_online_status', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        }
+    }).catch(() => {});
+}
+
+// راه‌اندازی
+document.addEventListener('DOMContentLoaded', function() {
+    const renderedMessages = document.querySelectorAll('#messagesContainer .message[data-message-id]');
+    if (renderedMessages.length) {
+        lastMessageId = Number(renderedMessages[renderedMessages.length - 1].dataset.messageId);
+    }
+    scrollToBottom();
+    document.getElementById('messageInput').focus();
+    
+    // آپدیت خودکار هر 2 ثانیه
+    setInterval(getNewMessages, 2000);
+    
+    // آپدیت وضعیت آنلاین هر 30 ثانیه
+    setInterval(updateOnlineStatus, 30000);
+    
+    // اعتبارسنجی input
+    const messageInput = document.getElementById('messageInput');
+    const sendButton = document.getElementById('sendButton');
+    
+    messageInput.addEventListener('input', function() {
+        sendButton.disabled = !this.value.trim();
+        notifyTyping(Boolean(this.value.trim()));
+    });
+    
+    messageInput.addEventListener('blur', function() {
+        notifyTyping(false);
+    });
+});
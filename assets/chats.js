@@ -0,0 +1,184 @@
+// آپدیت وضعیت آنلاین هر 30 ثانیه
+function updateOnlineStatus() {
+    fetch('/api/update_online_status', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        }
+    }).catch(() => {});
+}
+
+setInterval(updateOnlineStatus, 30000);
+
+// پاک کردن پیام‌های alert بعد از 8 ثانیه
+setTimeout(() => {
+    const alerts = document.querySelectorAll('.alert');
+    alerts.forEach(alert => {
+        const bsAlert = new bootstrap.Alert(alert);
+        bsAlert.close();
+    });
+}, 8000);
+
+// اسکرول به پایین لیست چت‌ها
+document.addEventListener('DOMContentLoaded', function() {
+    const chatsList = document.querySelector('.chats-list');
+    if (chatsList) {
+        chatsList.scrollTop = 0;
+    }
+});
+
+// جستجوی مخاطب هنگام تایپ (با تأخیر 250ms و لغو درخواست قبلی)
+const USER_SEARCH_DELAY = 250;
+let userSearchTimer = null;
+let userSearchController = null;
+
+function escapeHtml(text) {
+    const div = document.createElement('div');
+    div.textContent = text;
+    return div.innerHTML;
+}
+
+function renderUserSearchResults(users) {
+    const results = document.getElementById('userSearchResults');
+    results.innerHTML = users.map(user => `
+        <button type="button" class="list-group-item list-group-item-action" data-user-id="${escapeHtml(user.user_id)}">
+            <span>
+                ${escapeHtml(user.name)}
+                ${user.is_online ? '<i class="fas fa-circle text-success ms-1" style="font-size: 0.6em;"></i>' : ''}
+            </span>
+            <span class="user-search-id">${escapeHtml(user.user_id)}</span>
+        </button>
+    `).join('');
+}
+
+function searchUsers(query) {
+    if (userSearchController) {
+        userSearchController.abort();
+    }
+    if (!query) {
+        renderUserSearchResults([]);
+        return;
+    }
+    userSearchController = new AbortController();
+    fetch(`/api/users/search?q=${encodeURIComponent(query)}`, { signal: userSearchController.signal })
+        .then(response => response.json())
+        .then(data => {
+            if (data.success) {
+                renderUserSearchResults(data.users);
+            }
+        })
+        .catch(() => {});
+}
+
+document.addEventListener('DOMContentLoaded', function() {
+    const input = document.getElementById('userSearchInput');
+    const results = document.getElementById('userSearchResults');
+    if (!input || !results) {
+        return;
+    }
+
+    input.addEventListener('input', function() {
+        clearTimeout(userSearchTimer);
+        userSearchTimer = setTimeout(() => searchUsers(input.value.trim()), USER_SEARCH_DELAY);
+    });
+
+    // انتخاب نتیجه: شناسه در فرم قرار می‌گیرد و چت شروع می‌شود
+    results.addEventListener('click', function(event) {
+        const item = event.target.closest('[data-user-id]');
+        if (item) {
+            input.value = item.dataset.userId;
+            input.form.submit();
+        }
+    });
+});
+
+// همگام‌سازی صندوق: یک درخواست برای همه چت‌ها و گروه‌ها از آخرین cursor
+const INBOX_SYNC_INTERVAL = 3000;
+let syncCursor = (window.INBOX_CONFIG || {}).syncCursor;
+let syncInFlight = false;
+
+function inboxPreview(entry) {
+    const message = entry.last_message;
+    if (entry.conversation_id.startsWith('group:')) {
+        return message.sender_name ? `${escapeHtml(message.sender_name)}: ${escapeHtml(message.content)}` : escapeHtml(message.content);
+    }
+    if (message.is_me) {
+        return `<i class="fas fa-check text-muted me-1"></i>شما: ${escapeHtml(message.content)}`;
+    }
+    return escapeHtml(message.content);
+}
+
+function updateInboxItem(item, entry) {
+    if (entry.last_message) {
+        item.querySelector('.chat-last-message').innerHTML = inboxPreview(entry);
+        item.querySelector('.chat-time').textContent = entry.last_message.timestamp;
+    }
+    if (entry.new_messages > 0) {
+        let badge = item.querySelector('.unread-badge');
+        if (!badge) {
+            badge = document.createElement('div');
+            badge.className = 'unread-badge';
+            badge.textContent = '0';
+            item.querySelector('.chat-preview').appendChild(badge);
+        }
+        badge.textContent = parseInt(badge.textContent, 10) + entry.new_messages;
+    }
+    // انتقال به بالای بخش خودش (چت‌های خصوصی یا گروه‌ها)
+    let first = item;
+    while (first.previousElementSibling && first.previousElementSibling.classList.contains('chat-item')) {
+        first = first.previousElementSibling;
+    }
+    if (first !== item) {
+        item.parentNode.insertBefore(item, first);
+    }
+}
+
+function applyInboxSync(data) {
+    let needsReload = false;
+    // inbox به ترتیب جدیدترین است؛ از قدیمی‌ترین اعمال می‌شود تا جدیدترین بالای لیست بماند
+    data.inbox.slice().reverse().forEach(entry => {
+        const item = document.querySelector(`.chat-item[data-conversation-id="${entry.conversation_id}"]`);
+        if (item) {
+            updateInboxItem(item, entry);
+        } else {
+            needsReload = true;
+        }
+    });
+    // مکالمه‌ای که در تب دیگری خوانده شده
+    data.seen.forEach(seen => {
+        const badge = document.querySelector(`.chat-item[data-conversation-id="${seen.conversation_id}"] .unread-badge`);
+        if (badge) {
+            badge.remove();
+        }
+    });
+    return needsReload;
+}
+
+function syncInbox() {
+    if (syncCursor === undefined || syncInFlight || document.hidden) {
+        return;
+    }
+    syncInFlight = true;
+    fetch(`/api/sync?cursor=${syncCursor}`)
+        .then(response => response.json())
+        .then(data => {
+            if (!data.success) {
+                return;
+            }
+            // مکالمه جدید یا cursor منقضی: لیست از سرور دوباره ساخته می‌شود
+            if (data.reset || applyInboxSync(data)) {
+                location.reload();
+                return;
+            }
+            syncCursor = data.cursor;
+            if (data.has_more) {
+                setTimeout(syncInbox, 0);
+            }
+        })
+        .catch(() => {})
+        .finally(() => {
+            syncInFlight = false;
+        });
+}
+
+setInterval(syncInbox, INBOX_SYNC_INTERVAL);
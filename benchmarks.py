@@ -0,0 +1,280 @@
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+
+# دیتابیس موقت جدا از دیتابیس برنامه؛ باید پیش از import app تنظیم شود
+def setup_app(directory):
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(directory, 'bench.db')
+    os.environ['EVENT_BUS_URL'] = 'sqlite:///' + os.path.join(directory, 'events.db')
+    os.environ.pop('DATABASE_REPLICA_URL', None)
+    os.environ.pop('DATABASE_SHARD_URLS', None)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import app as app_module
+    app_module.app.config['TESTING'] = True
+    return app_module
+
+
+def measure(function, repeat):
+    function()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - started) * 1000)
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return statistics.median(timings), peak / 1024
+
+
+def print_rows(rows):
+    print(f'{"case":<34}{"median ms":>12}{"peak KiB":>12}{"speedup":>10}')
+    for name, (orm_ms, orm_kib), (view_ms, view_kib) in rows:
+        print(f'{name + " (orm)":<34}{orm_ms:>12.2f}{orm_kib:>12.0f}')
+        print(f'{name + " (view)":<34}{view_ms:>12.2f}{view_kib:>12.0f}{orm_ms / view_ms:>9.1f}x')
+
+
+# مسیرهای فقط‌خواندنی پیام‌ها: شیء ORM (روش قبلی) در برابر select ستونی و MessageView
+def bench_read_models(args):
+    app_module = setup_app(tempfile.mkdtemp())
+    db, Message = app_module.db, app_module.Message
+    conversation_ids = [app_module.chat_conversation_id(chat_id) for chat_id in range(1, args.conversations + 1)]
+
+    with app_module.app.app_context():
+        for conversation_id in conversation_ids:
+            db.session.add_all(Message(
+                conversation_id=conversation_id,
+                sender_id='A' * 10 if i % 2 else 'B' * 10,
+                sender_name='Sender',
+                content=f'message {i} ' * 4
+            ) for i in range(args.messages))
+        db.session.commit()
+
+        def to_dicts(messages):
+            return [{
+                'id': msg.id,
+                'content': msg.content,
+                'sender_id': msg.sender_id,
+                'sender_name': msg.sender_name,
+                'timestamp': msg.timestamp.strftime('%H:%M'),
+                'read': msg.read,
+                'delivered': msg.delivered,
+                'message_type': msg.message_type,
+                'file_name': msg.file_name,
+                'file_size': msg.file_size
+            } for msg in messages]
+
+        # هر اجرا session تازه دارد، مثل یک درخواست poll
+        def orm_history():
+            to_dicts(Message.query.filter_by(conversation_id=conversation_ids[0]).order_by(Message.id.asc()).all())
+            db.session.remove()
+
+        def view_history():
+            to_dicts(app_module.message_views(Message.conversation_id == conversation_ids[0]))
+            db.session.remove()
+
+        tail_after = db.session.query(Message.id).filter_by(conversation_id=conversation_ids[0]) \
+            .order_by(Message.id.desc()).offset(args.tail - 1).limit(1).scalar()
+
+        def orm_tail():
+            to_dicts(Message.query.filter(Message.conversation_id == conversation_ids[0], Message.id >= tail_after)
+                     .order_by(Message.id.asc()).all())
+            db.session.remove()
+
+        def view_tail():
+            to_dicts(app_module.message_views(Message.conversation_id == conversation_ids[0], Message.id >= tail_after))
+            db.session.remove()
+
+        def orm_inbox():
+            for conversation_id in conversation_ids:
+                Message.query.filter_by(conversation_id=conversation_id).order_by(Message.id.desc()).first()
+            db.session.remove()
+
+        def view_inbox():
+            for conversation_id in conversation_ids:
+                app_module.message_views(Message.conversation_id == conversation_id, newest_first=True, limit=1)
+            db.session.remove()
+
+        print(f'{args.conversations} conversations x {args.messages} messages, {args.repeat} runs per case\n')
+        print_rows([
+            (f'poll history ({args.messages})', measure(orm_history, args.repeat), measure(view_history, args.repeat)),
+            (f'poll tail ({args.tail})', measure(orm_tail, args.repeat), measure(view_tail, args.repeat)),
+            (f'inbox last messages ({args.conversations})', measure(orm_inbox, args.repeat), measure(view_inbox, args.repeat)),
+        ])
+
+
+# مسیر poll و صندوق: خواندن از دیتابیس در هر درخواست (روش قبلی) در برابر کش پیام‌های داغ
+def bench_hot_messages(args):
+    app_module = setup_app(tempfile.mkdtemp())
+    db, Message = app_module.db, app_module.Message
+    conversation_ids = [app_module.chat_conversation_id(chat_id) for chat_id in range(1, args.conversations + 1)]
+
+    with app_module.app.app_context():
+        for conversation_id in conversation_ids:
+            db.session.add_all(Message(
+                conversation_id=conversation_id,
+                sender_id='A' * 10 if i % 2 else 'B' * 10,
+                sender_name='Sender',
+                content=f'message {i} ' * 4
+            ) for i in range(args.messages))
+        db.session.commit()
+
+        tail_after = db.session.query(Message.id).filter_by(conversation_id=conversation_ids[0]) \
+            .order_by(Message.id.desc()).offset(args.tail).limit(1).scalar()
+
+        # هر دو حالت نسخه مکالمه را برای ETag می‌خوانند، پس فقط خواندن پیام‌ها متفاوت است
+        def database_poll():
+            app_module.chat_version(1)
+            app_module.message_views(Message.conversation_id == conversation_ids[0], Message.id > tail_after)
+            db.session.remove()
+
+        def cached_poll():
+            app_module.conversation_messages(conversation_ids[0], app_module.chat_version(1), tail_after)
+            db.session.remove()
+
+        def database_inbox():
+            for conversation_id in conversation_ids:
+                app_module.message_views(Message.conversation_id == conversation_id, newest_first=True, limit=1)
+            db.session.remove()
+
+        def cached_inbox():
+            app_module.latest_messages(conversation_ids)
+            db.session.remove()
+
+        for chat_id, conversation_id in enumerate(conversation_ids, 1):
+            app_module.conversation_messages(conversation_id, app_module.chat_version(chat_id))
+        db.session.remove()
+
+        print(f'{args.conversations} conversations x {args.messages} messages, {args.repeat} runs per case\n')
+        print(f'{"case":<34}{"median ms":>12}{"peak KiB":>12}{"speedup":>10}')
+        for name, database_case, cached_case in [
+            (f'poll tail ({args.tail})', database_poll, cached_poll),
+            (f'inbox last messages ({args.conversations})', database_inbox, cached_inbox),
+        ]:
+            (database_ms, database_kib), (cached_ms, cached_kib) = measure(database_case, args.repeat), measure(cached_case, args.repeat)
+            print(f'{name + " (database)":<34}{database_ms:>12.2f}{database_kib:>12.0f}')
+            print(f'{name + " (cache)":<34}{cached_ms:>12.2f}{cached_kib:>12.0f}{database_ms / cached_ms:>9.1f}x')
+        print(f'\ncache: {app_module.hot_messages.stats()}')
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)] if values else 0.0
+
+
+# یک worker همگام gunicorn (بدون --threads): درخواست‌ها یکی‌یکی سرو می‌شوند
+class SerializedApp:
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+        self.lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        with self.lock:
+            return list(self.wsgi_app(environ, start_response))
+
+
+# موج لاگین هم‌زمان: throughput لاگین و تأخیر درخواست‌های سبک هم‌زمان (صفحه اصلی)
+# «sync worker» رفتار قبلی است؛ «threads» هش در thread هر درخواست بدون سقف؛ «threads + pool» با سقف هسته‌های CPU
+def bench_password_hashing(args):
+    app_module = setup_app(tempfile.mkdtemp())
+    from passwords import PasswordHasher
+    from werkzeug.security import generate_password_hash
+    app = app_module.app
+    cores = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else (os.cpu_count() or 1)
+
+    password_hash = generate_password_hash('bench-password', args.method)
+    phones = [f'09{i:09d}' for i in range(args.clients)]
+    with app.app_context():
+        app_module.db.session.add_all(app_module.User(
+            name=f'Bench {i}', phone=phone, user_id=f'{i:010X}', password_hash=password_hash
+        ) for i, phone in enumerate(phones))
+        app_module.db.session.commit()
+
+    def run(hasher, serialized):
+        app_module.password_hasher = hasher
+        app.wsgi_app = SerializedApp(original_wsgi_app) if serialized else original_wsgi_app
+        done = threading.Event()
+        probe_latencies = []
+
+        def client(phone):
+            test_client = app.test_client()
+            for _ in range(args.logins):
+                test_client.post('/login', data={'name': 'Bench', 'phone': phone, 'password': 'bench-password'})
+
+        def probe():
+            test_client = app.test_client()
+            while not done.is_set():
+                started = time.perf_counter()
+                test_client.get('/')
+                probe_latencies.append((time.perf_counter() - started) * 1000)
+                time.sleep(0.01)
+
+        threads = [threading.Thread(target=client, args=(phone,)) for phone in phones]
+        probe_thread = threading.Thread(target=probe)
+        probe_thread.start()
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        done.set()
+        probe_thread.join()
+        logins_per_second = args.clients * args.logins / elapsed
+        return logins_per_second, logins_per_second / min(hasher.max_workers, cores), \
+            percentile(probe_latencies, 0.5), percentile(probe_latencies, 0.95)
+
+    original_wsgi_app = app.wsgi_app
+    started = time.perf_counter()
+    generate_password_hash('bench-password', args.method)
+    print(f'method {args.method}: {(time.perf_counter() - started) * 1000:.0f} ms per hash, '
+          f'{args.clients} concurrent clients x {args.logins} logins, {cores} core(s)\n')
+    print(f'{"mode":<26}{"logins/s":>10}{"per core":>10}{"probe p50 ms":>14}{"probe p95 ms":>14}')
+    uncapped = PasswordHasher(args.method, max_workers=args.clients, max_pending=args.clients, wait_timeout=60)
+    pooled = PasswordHasher(args.method, max_workers=cores, max_pending=args.clients, wait_timeout=60)
+    for name, hasher, serialized in [
+        ('sync worker (before)', uncapped, True),
+        ('threads', uncapped, False),
+        (f'threads + pool ({cores})', pooled, False),
+    ]:
+        logins_per_second, per_core, p50, p95 = run(hasher, serialized)
+        print(f'{name:<26}{logins_per_second:>10.1f}{per_core:>10.1f}{p50:>14.1f}{p95:>14.1f}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmarks for hot paths (run against a temporary SQLite database).')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    read_models = subparsers.add_parser('read-models', help='ORM objects vs column-projected read models')
+    read_models.add_argument('--conversations', type=int, default=50)
+    read_models.add_argument('--messages', type=int, default=2000, help='messages per conversation')
+    read_models.add_argument('--tail', type=int, default=20, help='messages returned by an incremental poll')
+    read_models.add_argument('--repeat', type=int, default=30)
+    read_models.set_defaults(handler=bench_read_models)
+
+    hot_messages = subparsers.add_parser('hot-messages', help='database reads vs the per-conversation hot message cache')
+    hot_messages.add_argument('--conversations', type=int, default=50)
+    hot_messages.add_argument('--messages', type=int, default=2000, help='messages per conversation')
+    hot_messages.add_argument('--tail', type=int, default=20, help='messages returned by an incremental poll')
+    hot_messages.add_argument('--repeat', type=int, default=30)
+    hot_messages.set_defaults(handler=bench_hot_messages)
+
+    password_hashing = subparsers.add_parser('password-hashing', help='login throughput with inline vs pooled password hashing')
+    password_hashing.add_argument('--method', default='scrypt', help='Werkzeug hash method, e.g. scrypt:32768:8:1 or pbkdf2:sha256:600000')
+    password_hashing.add_argument('--clients', type=int, default=8, help='concurrent login clients')
+    password_hashing.add_argument('--logins', type=int, default=5, help='logins per client')
+    password_hashing.set_defaults(handler=bench_password_hashing)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == '__main__':
+    main()
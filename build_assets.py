@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+import re
+
+# مسیر فایل‌های منبع و خروجی باندل‌ها
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ASSETS_SRC_DIR = os.path.join(BASE_DIR, 'assets')
+ASSETS_DIST_DIR = os.path.join(BASE_DIR, 'static', 'dist')
+MANIFEST_NAME = 'manifest.json'
+
+# رشته‌ها و کامنت‌های CSS به صورت جداگانه تشخیص داده می‌شوند تا محتوای رشته‌ها دست نخورد
+CSS_TOKEN_RE = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\')|(/\*.*?\*/)', re.S)
+CSS_SPACE_RE = re.compile(r'\s+')
+CSS_PUNCT_RE = re.compile(r'\s*([{};,>])\s*')
+# فقط فاصله بعد از دونقطه حذف می‌شود؛ فاصله قبل از آن در selectorها (مثل «div :hover») معنادار است
+CSS_COLON_RE = re.compile(r':\s+')
+
+
+def _minify_css_chunk(chunk):
+    chunk = CSS_SPACE_RE.sub(' ', chunk)
+    chunk = CSS_PUNCT_RE.sub(r'\1', chunk)
+    chunk = CSS_COLON_RE.sub(':', chunk)
+    chunk = chunk.replace(';}', '}')
+    return chunk
+
+
+def minify_css(source):
+    parts = []
+    pending = ''
+    last = 0
+    for match in CSS_TOKEN_RE.finditer(source):
+        pending += source[last:match.start()]
+        if match.group(1):
+            parts.append(_minify_css_chunk(pending))
+            parts.append(match.group(1))
+            pending = ''
+        last = match.end()
+    parts.append(_minify_css_chunk(pending + source[last:]))
+    return ''.join(parts).strip() + '\n'
+
+
+# کوچک‌سازی محافظه‌کارانه JS: حذف خطوط کامنت، تورفتگی و خطوط خالی (شکستن خطوط برای ASI حفظ می‌شود)
+def minify_js(source):
+    lines = []
+    for line in source.splitlines():
+        stripped = line.strip()
+        if not stripped or stripped.startswith('//'):
+            continue
+        lines.append(stripped)
+    return '\n'.join(lines) + '\n'
+
+
+MINIFIERS = {
+    '.css': minify_css,
+    '.js': minify_js,
+}
+
+
+def build(src_dir=ASSETS_SRC_DIR, dist_dir=ASSETS_DIST_DIR):
+    os.makedirs(dist_dir, exist_ok=True)
+    manifest = {}
+
+    for name in source_names(src_dir):
+        stem, ext = os.path.splitext(name)
+        minify = MINIFIERS[ext]
+
+        with open(os.path.join(src_dir, name), encoding='utf-8') as f:
+            content = minify(f.read()).encode('utf-8')
+
+        digest = hashlib.sha256(content).hexdigest()[:12]
+        fingerprinted = f'{stem}.{digest}.min{ext}'
+        target = os.path.join(dist_dir, fingerprinted)
+
+        # فایل‌های هش‌دار تغییرناپذیرند؛ اگر وجود دارد دوباره نوشته نمی‌شود
+        if not os.path.exists(target):
+            tmp_path = f'{target}.{os.getpid()}.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(content)
+            os.replace(tmp_path, target)
+
+        manifest[name] = fingerprinted
+
+    manifest_path = os.path.join(dist_dir, MANIFEST_NAME)
+    tmp_path = f'{manifest_path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+    return manifest
+
+
+def source_names(src_dir=ASSETS_SRC_DIR):
+    return sorted(name for name in os.listdir(src_dir) if os.path.splitext(name)[1] in MINIFIERS)
+
+
+# manifest قدیمی است اگر نباشد، فایل منبعی اضافه یا حذف شده باشد یا منبعی بعد از آن تغییر کرده باشد
+def is_stale(src_dir=ASSETS_SRC_DIR, dist_dir=ASSETS_DIST_DIR):
+    manifest = load_manifest(dist_dir)
+    if manifest is None or sorted(manifest) != source_names(src_dir):
+        return True
+    if not all(os.path.exists(os.path.join(dist_dir, bundle)) for bundle in manifest.values()):
+        return True
+    built = os.path.getmtime(os.path.join(dist_dir, MANIFEST_NAME))
+    return any(os.path.getmtime(os.path.join(src_dir, name)) > built for name in manifest)
+
+
+# manifest فعلی، یا ساخت دوباره باندل‌ها اگر منابع تغییر کرده باشند
+def ensure_built(src_dir=ASSETS_SRC_DIR, dist_dir=ASSETS_DIST_DIR):
+    if is_stale(src_dir, dist_dir):
+        return build(src_dir, dist_dir)
+    return load_manifest(dist_dir)
+
+
+def load_manifest(dist_dir=ASSETS_DIST_DIR):
+    try:
+        with open(os.path.join(dist_dir, MANIFEST_NAME), encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+
+if __name__ == '__main__':
+    result = build()
+    for source, bundle in sorted(result.items()):
+        print(f'{source} -> static/dist/{bundle}')
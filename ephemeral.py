@@ -0,0 +1,55 @@
+import threading
+import time
+
+
+# سیگنال‌های زودگذر (مثل «در حال نوشتن…») فقط در حافظه با TTL کوتاه؛ هیچ چیز در دیتابیس نوشته نمی‌شود
+class EphemeralSignalStore:
+    def __init__(self, ttl=5.0):
+        self.ttl = ttl
+        self._signals = {}
+        self._lock = threading.Lock()
+        self._last_sweep = time.monotonic()
+
+    def set(self, conversation_id, user_id, name, ttl=None):
+        now = time.monotonic()
+        with self._lock:
+            self._signals.setdefault(conversation_id, {})[user_id] = (name, now + (ttl or self.ttl))
+            if now - self._last_sweep > self.ttl:
+                self._sweep(now)
+
+    # حذف مکالمه‌هایی که دیگر کسی آن‌ها را نمی‌خواند (active صدا زده نمی‌شود)
+    def _sweep(self, now):
+        for conversation_id in list(self._signals):
+            signals = self._signals[conversation_id]
+            for user_id in [user_id for user_id, (_, expires) in signals.items() if expires <= now]:
+                del signals[user_id]
+            if not signals:
+                del self._signals[conversation_id]
+        self._last_sweep = now
+
+    def clear(self, conversation_id, user_id):
+        with self._lock:
+            signals = self._signals.get(conversation_id)
+            if signals:
+                signals.pop(user_id, None)
+                if not signals:
+                    del self._signals[conversation_id]
+
+    # کاربران فعال یک مکالمه به صورت [(user_id, name)]؛ موارد منقضی همین‌جا پاک می‌شوند
+    def active(self, conversation_id, exclude=None):
+        now = time.monotonic()
+        with self._lock:
+            signals = self._signals.get(conversation_id)
+            if not signals:
+                return []
+            expired = [user_id for user_id, (_, expires) in signals.items() if expires <= now]
+            for user_id in expired:
+                del signals[user_id]
+            if not signals:
+                del self._signals[conversation_id]
+                return []
+            return sorted((user_id, name) for user_id, (name, _) in signals.items() if user_id != exclude)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._signals)
@@ -0,0 +1,286 @@
+import atexit
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# انواع رویدادهایی که مسیرهای نوشتن در app.py منتشر می‌کنند؛ هر کدام در همه workerها مشترک دارد
+# (کش پیام‌های داغ، کش نمایش کاربران، ایندکس عضویت، تایپ، تنظیمات پروفایل)
+MESSAGE_CREATED = 'message.created'
+RECEIPT_UPDATED = 'receipt.updated'
+USER_CHANGED = 'user.changed'
+MEMBERSHIP_CHANGED = 'membership.changed'
+TYPING_CHANGED = 'typing.changed'
+PROFILING_CHANGED = 'profiling.changed'
+
+Event = namedtuple('Event', ['type', 'payload'])
+
+
+# پایه باس رویداد: مشترک‌ها در همین پروسه فراخوانی می‌شوند و backend رویداد را به سایر workerها می‌رساند
+class EventBus:
+    # backendی که رویدادها را در ذخیره‌ساز ماندگار می‌نویسد (برای سیگنال‌های گذرا مناسب نیست)
+    persistent = False
+
+    def __init__(self):
+        self.sequence = 0
+        self._handlers = []
+        self._write_handlers = []
+        self._cond = threading.Condition()
+        self._listener = None
+        self._listener_lock = threading.Lock()
+
+    # شناسه فرستنده بر اساس pid محاسبه می‌شود تا بعد از fork هر worker شناسه خود را داشته باشد
+    @property
+    def origin(self):
+        return f'{socket.gethostname()}:{os.getpid()}:{id(self):x}'
+
+    def subscribe(self, handler):
+        self._handlers.append(handler)
+        self._ensure_listening()
+        return handler
+
+    # فراخوانی پس از هر نوشتن backend در ذخیره‌ساز ماندگار، تا در شمارش نوشتن‌های درخواست دیده شود
+    def on_write(self, handler):
+        self._write_handlers.append(handler)
+        return handler
+
+    def publish(self, event_type, **payload):
+        event = Event(event_type, payload)
+        self._send(event)
+        self._dispatch(event)
+        return event
+
+    # منتظر ماندن تا رسیدن رویدادی جدیدتر از sequence داده شده (برای pollerهای منتظر)
+    def wait(self, sequence, timeout=None):
+        self._ensure_listening()
+        with self._cond:
+            self._cond.wait_for(lambda: self.sequence > sequence, timeout)
+            return self.sequence
+
+    def _dispatch(self, event):
+        for handler in list(self._handlers):
+            try:
+                handler(event)
+            except Exception as e:
+                logger.error(f"Event handler error ({event.type}): {str(e)}")
+        with self._cond:
+            self.sequence += 1
+            self._cond.notify_all()
+
+    def _ensure_listening(self):
+        # thread شنونده با fork کپی نمی‌شود، پس در هر worker به صورت تنبل ساخته می‌شود
+        if self._listener is not None and self._listener.is_alive():
+            return
+        with self._listener_lock:
+            if self._listener is not None and self._listener.is_alive():
+                return
+            target = self._listen_target()
+            if target is None:
+                return
+            self._listener = threading.Thread(target=target, name=f'{type(self).__name__}-listener', daemon=True)
+            self._listener.start()
+
+    def _listen_target(self):
+        return None
+
+    def _send(self, event):
+        pass
+
+
+# فقط داخل همین پروسه (مناسب اجرای تک worker و محیط توسعه)
+class MemoryEventBus(EventBus):
+    pass
+
+
+# change log مشترک در یک فایل SQLite؛ هر worker رکوردهای جدید را دنبال می‌کند و نیازی به سرویس خارجی ندارد
+class SQLiteEventBus(EventBus):
+    persistent = True
+
+    def __init__(self, path, poll_interval=0.2, retention=3600):
+        super().__init__()
+        self.path = path
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self._local = threading.local()
+
+        conn = self._connection()
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS events ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+            'created REAL NOT NULL, '
+            'origin TEXT NOT NULL, '
+            'type TEXT NOT NULL, '
+            'payload TEXT NOT NULL)'
+        )
+        conn.execute('CREATE INDEX IF NOT EXISTS ix_events_created ON events (created)')
+        self._last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM events').fetchone()[0]
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _send(self, event):
+        self._connection().execute(
+            'INSERT INTO events (created, origin, type, payload) VALUES (?, ?, ?, ?)',
+            (time.time(), self.origin, event.type, json.dumps(event.payload))
+        )
+        for handler in self._write_handlers:
+            handler(event)
+
+    def _listen_target(self):
+        return self._tail
+
+    def _tail(self):
+        last_prune = 0
+        while True:
+            try:
+                conn = self._connection()
+                rows = conn.execute(
+                    'SELECT id, origin, type, payload FROM events WHERE id > ? ORDER BY id',
+                    (self._last_id,)
+                ).fetchall()
+                for row_id, origin, event_type, payload in rows:
+                    self._last_id = row_id
+                    # رویدادهای همین worker هنگام publish به صورت همزمان پخش شده‌اند
+                    if origin != self.origin:
+                        self._dispatch(Event(event_type, json.loads(payload)))
+
+                now = time.time()
+                if now - last_prune > 60:
+                    conn.execute('DELETE FROM events WHERE created < ?', (now - self.retention,))
+                    last_prune = now
+            except Exception as e:
+                logger.error(f"Event log tail error: {str(e)}")
+            time.sleep(self.poll_interval)
+
+
+# backend مبتنی بر pub/sub ردیس (یا سرویس سازگار)؛ پکیج redis فقط هنگام استفاده لازم است
+class RedisEventBus(EventBus):
+    def __init__(self, url, channel='mailgram:events'):
+        super().__init__()
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError('Redis event bus requires the "redis" package')
+        self.channel = channel
+        self._client = redis.Redis.from_url(url)
+
+    def _send(self, event):
+        message = {'origin': self.origin, 'type': event.type, 'payload': event.payload}
+        self._client.publish(self.channel, json.dumps(message))
+
+    def _listen_target(self):
+        return self._listen
+
+    def _listen(self):
+        while True:
+            try:
+                pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                for item in pubsub.listen():
+                    message = json.loads(item['data'])
+                    if message['origin'] != self.origin:
+                        self._dispatch(Event(message['type'], message['payload']))
+            except Exception as e:
+                logger.error(f"Redis event listener error: {str(e)}")
+                time.sleep(1)
+
+
+# پخش بین workerهای همین سرور با سوکت‌های datagram یونیکس، بدون ذخیره‌سازی و بدون سرویس خارجی
+# هر پروسه یک سوکت در directory می‌سازد و publish یک datagram به سوکت بقیه می‌فرستد؛ سوکت پروسه‌های مرده
+# (ConnectionRefused) پاک می‌شود و اگر صف گیرنده پر باشد سیگنال گذرا دور ریخته می‌شود.
+class SocketEventBus(EventBus):
+    def __init__(self, directory, max_size=65536):
+        super().__init__()
+        self.directory = directory
+        self.max_size = max_size
+        self._sockets = None
+        self._pid = None
+        self._socket_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    # سوکت‌ها با fork کپی نمی‌شوند، پس در هر worker به صورت تنبل ساخته می‌شوند: (سوکت دریافت، سوکت ارسال، مسیر)
+    def _endpoint(self):
+        with self._socket_lock:
+            if self._sockets is None or self._pid != os.getpid():
+                path = os.path.join(self.directory, f'{os.getpid()}-{id(self):x}.sock')
+                if os.path.exists(path):
+                    os.unlink(path)
+                receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+                receiver.bind(path)
+                sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+                sender.setblocking(False)
+                self._sockets = (receiver, sender, path)
+                self._pid = os.getpid()
+                atexit.register(self._remove, path)
+            return self._sockets
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    def _send(self, event):
+        _, sender, own_path = self._endpoint()
+        data = json.dumps({'origin': self.origin, 'type': event.type, 'payload': event.payload}).encode('utf-8')
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if not name.endswith('.sock') or path == own_path:
+                continue
+            try:
+                sender.sendto(data, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                self._remove(path)
+            except BlockingIOError:
+                logger.warning(f"Signal dropped, receiver queue full: {name}")
+
+    def _listen_target(self):
+        return self._listen
+
+    def _listen(self):
+        receiver, _, _ = self._endpoint()
+        while True:
+            try:
+                message = json.loads(receiver.recv(self.max_size))
+                if message['origin'] != self.origin:
+                    self._dispatch(Event(message['type'], message['payload']))
+            except Exception as e:
+                logger.error(f"Socket event listener error: {str(e)}")
+                time.sleep(1)
+
+
+# ساخت باس از روی URL: memory:// ، sqlite:///path/to/events.db ، redis://host:port/db ، socket:///path/to/dir
+def create_event_bus(url):
+    if url.startswith('memory://'):
+        return MemoryEventBus()
+    if url.startswith('sqlite:///'):
+        return SQLiteEventBus(url[len('sqlite:///'):])
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisEventBus(url)
+    if url.startswith('socket:///'):
+        return SocketEventBus(url[len('socket:///'):])
+    raise ValueError(f'Unsupported event bus URL: {url}')
+
+
+# باس سیگنال‌های گذرا (مثل «در حال نوشتن…»)؛ فقط backendهای بدون ذخیره‌سازی (memory:// ، socket:/// یا redis pub/sub) مجازند
+def create_signal_bus(url):
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisEventBus(url, channel='mailgram:signals')
+    bus = create_event_bus(url)
+    if bus.persistent:
+        raise ValueError(f'Signal bus must not persist events: {url}')
+    return bus
@@ -0,0 +1,154 @@
+import sys
+import threading
+from collections import OrderedDict, deque
+
+
+# حجم تقریبی یک رکورد در حافظه: خود شیء به همراه رشته‌هایش
+def record_size(record):
+    size = sys.getsizeof(record)
+    for name in record.__slots__:
+        value = getattr(record, name)
+        if isinstance(value, str):
+            size += sys.getsizeof(value)
+    return size
+
+
+class ConversationTail:
+    __slots__ = ('messages', 'sizes', 'version', 'size')
+
+    def __init__(self, messages, version):
+        self.messages = deque(messages)
+        self.sizes = deque(record_size(message) for message in self.messages)
+        self.version = version
+        self.size = sum(self.sizes)
+
+
+# کش آخرین پیام‌های هر مکالمه (ring buffer با حداکثر per_conversation رکورد) در حافظه هر worker
+# هر دنباله با نسخه مکالمه (آخرین شناسه، تعداد پیام‌ها، ...) ذخیره می‌شود و فقط وقتی برگردانده می‌شود که نسخه
+# خوانده شده از دیتابیس با آن یکی باشد؛ نوشتن در workerهای دیگر با سیگنال (append/update/advance) اعمال می‌شود
+# و اگر سیگنال نرسد فقط باعث بارگذاری دوباره می‌شود.
+# با رسیدن حجم کل به max_bytes مکالمه‌هایی که مدت بیشتری خوانده نشده‌اند (LRU) حذف می‌شوند.
+class HotMessageCache:
+    def __init__(self, per_conversation=50, max_bytes=32 * 1024 * 1024):
+        self.per_conversation = per_conversation
+        self.max_bytes = max_bytes
+        self._tails = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+
+    # دنباله کش شده (از قدیم به جدید) یا None اگر نباشد یا با نسخه فعلی نخواند
+    def get(self, conversation_id, version):
+        version = tuple(version)
+        with self._lock:
+            tail = self._tails.get(conversation_id)
+            if tail is None:
+                self.misses += 1
+                return None
+            if tail.version != version:
+                self.stale += 1
+                self._drop(conversation_id)
+                return None
+            self.hits += 1
+            self._tails.move_to_end(conversation_id)
+            return list(tail.messages)
+
+    # آخرین پیام برای پیش‌نمایش صندوق؛ head همان (آخرین شناسه، تعداد پیام‌ها) است
+    def latest(self, conversation_id, head):
+        with self._lock:
+            tail = self._tails.get(conversation_id)
+            if tail is None or tail.version[:2] != tuple(head):
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._tails.move_to_end(conversation_id)
+            return tail.messages[-1] if tail.messages else None
+
+    def put(self, conversation_id, messages, version):
+        tail = ConversationTail(messages[-self.per_conversation:], tuple(version))
+        with self._lock:
+            self._drop(conversation_id)
+            self._tails[conversation_id] = tail
+            self._bytes += tail.size
+            self._evict()
+
+    # پیام تازه ثبت شده در همین worker؛ فقط به دنباله موجود اضافه می‌شود و نسخه را جلو می‌برد
+    # پیامی با شناسه کوچک‌تر از آخرین پیام (worker دیگر هم‌زمان نوشته) دنباله را نامعتبر می‌کند
+    def append(self, conversation_id, message):
+        with self._lock:
+            tail = self._tails.get(conversation_id)
+            if tail is None:
+                return
+            if tail.messages and message.id <= tail.messages[-1].id:
+                self._drop(conversation_id)
+                return
+            size = record_size(message)
+            tail.messages.append(message)
+            tail.sizes.append(size)
+            tail.size += size
+            self._bytes += size
+            while len(tail.messages) > self.per_conversation:
+                tail.messages.popleft()
+                removed = tail.sizes.popleft()
+                tail.size -= removed
+                self._bytes -= removed
+            tail.version = (message.id, tail.version[1] + 1) + tuple(tail.version[2:])
+            self._evict()
+
+    # اعمال تغییر ثبت شده (مثل رسیدها) روی رکوردهای کش شده پس از commit
+    def update(self, conversation_id, message_ids, **values):
+        message_ids = set(message_ids)
+        with self._lock:
+            tail = self._tails.get(conversation_id)
+            if tail is None:
+                return
+            for index, message in enumerate(tail.messages):
+                if message.id in message_ids:
+                    for name, value in values.items():
+                        setattr(message, name, value)
+                    size = record_size(message)
+                    tail.size += size - tail.sizes[index]
+                    self._bytes += size - tail.sizes[index]
+                    tail.sizes[index] = size
+
+    # جلو بردن نسخه فقط اگر دنباله هنوز همان نسخه‌ای باشد که تغییر روی آن اعمال شده
+    def advance(self, conversation_id, expected, version):
+        expected, version = tuple(expected), tuple(version)
+        with self._lock:
+            tail = self._tails.get(conversation_id)
+            if tail is None:
+                return
+            if tail.version == expected:
+                tail.version = version
+            else:
+                self._drop(conversation_id)
+
+    def _drop(self, conversation_id):
+        tail = self._tails.pop(conversation_id, None)
+        if tail is not None:
+            self._bytes -= tail.size
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and self._tails:
+            _, tail = self._tails.popitem(last=False)
+            self._bytes -= tail.size
+            self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.stale
+            return {
+                'conversations': len(self._tails),
+                'messages': sum(len(tail.messages) for tail in self._tails.values()),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'per_conversation': self.per_conversation,
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale': self.stale,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None
+            }
@@ -0,0 +1,116 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+# نگاشت LRU محدود؛ با پر شدن ظرفیت، قدیمی‌ترین کلید استفاده‌نشده حذف می‌شود
+class LRUDict:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._data = OrderedDict()
+
+    def get(self, key):
+        value = self._data.get(key)
+        if value is not None:
+            self._data.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def pop(self, key):
+        return self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+# ایندکس درون‌حافظه‌ای عضویت گروه‌ها: group_id -> اعضا و user_id -> گروه‌ها
+# هر دو طرف به صورت تنبل با loaderها پر می‌شوند و فقط عضویت جدید اضافه می‌شود (حذف عضو در برنامه وجود ندارد).
+# هر ورودی پس از max_age ثانیه دوباره از دیتابیس خوانده می‌شود تا عضویتی که رویدادش به این worker نرسیده همیشگی گم نشود.
+class MembershipIndex:
+    def __init__(self, load_members, load_groups, max_groups=10000, max_users=50000, max_age=300):
+        self._load_members = load_members
+        self._load_groups = load_groups
+        self._members = LRUDict(max_groups)
+        self._groups = LRUDict(max_users)
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        # بارگذاری‌های در جریان: (cache, key) -> [تعداد loaderها، عضویت‌های اضافه‌شده در حین بارگذاری]
+        self._loading = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _release(self, slot_key, slot):
+        slot[0] -= 1
+        if not slot[0]:
+            del self._loading[slot_key]
+
+    def _cached(self, cache, key, loader):
+        slot_key = (id(cache), key)
+        with self._lock:
+            entry = cache.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.hits += 1
+                return entry[1]
+            slot = self._loading.setdefault(slot_key, [0, set()])
+            slot[0] += 1
+        # بارگذاری بیرون از قفل انجام می‌شود تا کوئری دیتابیس بقیه threadها را متوقف نکند؛
+        # add()هایی که در این فاصله می‌رسند در slot جمع و پس از بارگذاری روی نتیجه اعمال می‌شوند
+        try:
+            loaded = set(loader(key))
+        except Exception:
+            with self._lock:
+                self._release(slot_key, slot)
+            raise
+        with self._lock:
+            self._release(slot_key, slot)
+            self.misses += 1
+            loaded |= slot[1]
+            entry = cache.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                entry[1].update(loaded)
+                return entry[1]
+            cache.put(key, (time.monotonic() + self.max_age, loaded))
+            return loaded
+
+    def members(self, group_id):
+        members = self._cached(self._members, group_id, self._load_members)
+        with self._lock:
+            return frozenset(members)
+
+    def groups_of(self, user_id):
+        groups = self._cached(self._groups, user_id, self._load_groups)
+        with self._lock:
+            return frozenset(groups)
+
+    def is_member(self, group_id, user_id):
+        members = self._cached(self._members, group_id, self._load_members)
+        with self._lock:
+            return user_id in members
+
+    # ثبت عضویت جدید در ورودی‌های حافظه و بارگذاری‌های در جریان؛ بقیه بعداً از دیتابیس بارگذاری می‌شوند
+    def add(self, group_id, user_id):
+        with self._lock:
+            for cache, key, value in ((self._members, group_id, user_id), (self._groups, user_id, group_id)):
+                entry = cache.get(key)
+                if entry is not None:
+                    entry[1].add(value)
+                slot = self._loading.get((id(cache), key))
+                if slot is not None:
+                    slot[1].add(value)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'groups': len(self._members),
+                'users': len(self._groups),
+                'hits': self.hits,
+                'misses': self.misses
+            }
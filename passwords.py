@@ -0,0 +1,65 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, check_password_hash, generate_password_hash
+
+
+# پیشوند هش (مثلاً scrypt:32768:8:1) مستقیم از رشته روش با همان پیش‌فرض‌های werkzeug ساخته می‌شود، بدون هش کردن
+def method_prefix(method):
+    name, *args = method.split(':')
+    if name == 'scrypt':
+        n, r, p = map(int, args) if args else (2 ** 15, 8, 1)
+        return f'scrypt:{n}:{r}:{p}'
+    if name == 'pbkdf2':
+        hash_name = args[0] if args else 'sha256'
+        iterations = int(args[1]) if len(args) > 1 else DEFAULT_PBKDF2_ITERATIONS
+        return f'pbkdf2:{hash_name}:{iterations}'
+    raise ValueError(f"Invalid hash method '{name}'.")
+
+
+# صف هش پر است؛ درخواست به جای منتظر ماندن نامحدود رد می‌شود
+class HashingBusy(Exception):
+    pass
+
+
+# هش رمز عبور در pool محدود: حداکثر max_workers هش هم‌زمان در هر پروسه و حداکثر max_pending درخواست در صف
+# scrypt و pbkdf2 در hashlib قفل GIL را آزاد می‌کنند، پس بقیه threadهای worker در حین هش درخواست‌های دیگر را سرو می‌کنند
+# و موج لاگین فقط به اندازه max_workers هسته CPU مصرف می‌کند.
+class PasswordHasher:
+    def __init__(self, method='scrypt', max_workers=None, max_pending=None, wait_timeout=5.0):
+        self.method = method
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.max_workers * 4
+        self.wait_timeout = wait_timeout
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+        self.method_prefix = method_prefix(method)
+
+    # pool با fork کپی نمی‌شود، پس در هر worker به صورت تنبل ساخته می‌شود
+    def _pool(self):
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='PasswordHasher')
+                self._pid = os.getpid()
+            return self._executor
+
+    def _run(self, function, *args):
+        if not self._slots.acquire(timeout=self.wait_timeout):
+            raise HashingBusy()
+        try:
+            return self._pool().submit(function, *args).result()
+        finally:
+            self._slots.release()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    # هش با روش یا هزینه قدیمی پس از لاگین موفق با تنظیمات فعلی دوباره ساخته می‌شود
+    def needs_rehash(self, password_hash):
+        return password_hash.split('$', 1)[0] != self.method_prefix
@@ -0,0 +1,153 @@
+import cProfile
+import json
+import os
+import pstats
+import re
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+
+PROFILE_ID_PATTERN = re.compile(r'^\d{13}-[0-9a-f]{6}$')
+
+# فایل‌های هر پروفایل: متادیتا و timeline SQL، خروجی cProfile (pstats) و پشته‌های folded برای flamegraph
+PROFILE_FILES = {
+    'json': 'application/json',
+    'prof': 'application/octet-stream',
+    'folded': 'text/plain'
+}
+
+
+# پشته یک frame در قالب folded (ریشه اول، جداشده با ;) که flamegraph.pl و speedscope می‌خوانند
+def fold_stack(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+# نمونه‌بردار پشته: یک thread مشترک هر interval ثانیه پشته threadهای ثبت شده را می‌شمارد
+# سربار آن به تعداد درخواست‌ها وابسته نیست، پس برای پروفایل خودکار درخواست‌های کند همیشه روشن می‌ماند.
+class StackSampler:
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self._active = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self, thread_id):
+        samples = Counter()
+        with self._lock:
+            self._active[thread_id] = samples
+            # thread با fork کپی نمی‌شود، پس در هر worker به صورت تنبل ساخته می‌شود
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='StackSampler', daemon=True)
+                self._thread.start()
+        return samples
+
+    def stop(self, thread_id):
+        with self._lock:
+            return self._active.pop(thread_id, Counter())
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                if not self._active:
+                    continue
+                frames = sys._current_frames()
+                for thread_id, samples in self._active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None and thread_id != own_id:
+                        samples[fold_stack(frame)] += 1
+
+
+# پرتکرارترین توابع بر اساس زمان تجمعی برای نمایش در پنل
+def top_functions(profiler, limit=25):
+    stats = pstats.Stats(profiler)
+    rows = []
+    for (filename, line, name), (_, calls, own_time, total_time, _) in stats.stats.items():
+        rows.append({
+            'function': f'{name} ({os.path.basename(filename)}:{line})',
+            'calls': calls,
+            'own_ms': round(own_time * 1000, 2),
+            'total_ms': round(total_time * 1000, 2)
+        })
+    rows.sort(key=lambda row: row['total_ms'], reverse=True)
+    return rows[:limit]
+
+
+# ذخیره پروفایل‌ها روی دیسک به صورت ring buffer (قدیمی‌ترین‌ها پس از max_profiles حذف می‌شوند)
+# دیسک بین workerهای یک سرور مشترک است، پس هر worker می‌تواند پروفایل ثبت شده توسط دیگری را سرو کند.
+class ProfileStore:
+    def __init__(self, directory, max_profiles=50):
+        self.directory = directory
+        self.max_profiles = max_profiles
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, profile_id, kind):
+        if not PROFILE_ID_PATTERN.match(profile_id) or kind not in PROFILE_FILES:
+            return None
+        path = os.path.join(self.directory, f'{profile_id}.{kind}')
+        return path if os.path.exists(path) else None
+
+    def save(self, record, profiler=None, samples=None):
+        profile_id = f'{int(time.time() * 1000)}-{secrets.token_hex(3)}'
+        record = dict(record, id=profile_id, files=['json'])
+        if profiler is not None:
+            pstats.Stats(profiler).dump_stats(os.path.join(self.directory, f'{profile_id}.prof'))
+            record['functions'] = top_functions(profiler)
+            record['files'].append('prof')
+        if samples:
+            with open(os.path.join(self.directory, f'{profile_id}.folded'), 'w', encoding='utf-8') as f:
+                for stack, count in samples.most_common():
+                    f.write(f'{stack} {count}\n')
+            record['samples'] = sum(samples.values())
+            record['files'].append('folded')
+        # فایل json در آخر نوشته می‌شود تا پروفایل ناقص در فهرست دیده نشود
+        with open(os.path.join(self.directory, f'{profile_id}.json'), 'w', encoding='utf-8') as f:
+            json.dump(record, f, ensure_ascii=False)
+        self._trim()
+        return profile_id
+
+    def _ids(self):
+        return sorted(name[:-5] for name in os.listdir(self.directory)
+                      if name.endswith('.json') and PROFILE_ID_PATTERN.match(name[:-5]))
+
+    def _trim(self):
+        with self._lock:
+            for profile_id in self._ids()[:-self.max_profiles]:
+                for kind in PROFILE_FILES:
+                    try:
+                        os.remove(os.path.join(self.directory, f'{profile_id}.{kind}'))
+                    except OSError:
+                        pass
+
+    def get(self, profile_id):
+        path = self.path(profile_id, 'json')
+        if not path:
+            return None
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+
+    # فهرست پروفایل‌ها از جدید به قدیم (بدون timeline و توابع)
+    def list(self):
+        records = []
+        for profile_id in reversed(self._ids()):
+            record = self.get(profile_id)
+            if record:
+                record.pop('sql', None)
+                record.pop('functions', None)
+                records.append(record)
+        return records
+
+
+def new_profiler():
+    profiler = cProfile.Profile()
+    profiler.enable()
+    return profiler
@@ -0,0 +1,47 @@
+# رکوردهای فقط‌خواندنی برای مسیرهای پرتکرار (poll پیام‌ها، همگام‌سازی صندوق)
+# از ردیف کوئری‌های ستونی ساخته می‌شوند: بدون identity map، ردیابی تغییرات و بارگذاری تنبل ORM.
+# مدل‌های ORM فقط برای نوشتن استفاده می‌شوند؛ فیلدها قابل تغییرند تا رسیدهای ثبت شده در همان درخواست روی پاسخ اعمال شوند.
+
+
+class MessageView:
+    __slots__ = ('id', 'conversation_id', 'sender_id', 'sender_name', 'content', 'message_type',
+                 'file_name', 'file_size', 'timestamp', 'read', 'delivered', 'read_by')
+
+    def __init__(self, id, conversation_id, sender_id, sender_name, content, message_type,
+                 file_name, file_size, timestamp, read, delivered, read_by):
+        self.id = id
+        self.conversation_id = conversation_id
+        self.sender_id = sender_id
+        self.sender_name = sender_name
+        self.content = content
+        self.message_type = message_type
+        self.file_name = file_name
+        self.file_size = file_size
+        self.timestamp = timestamp
+        self.read = read
+        self.delivered = delivered
+        self.read_by = read_by
+
+    # رکورد پیامی که همین الان با ORM ثبت شده (برای افزودن به کش)
+    @classmethod
+    def from_object(cls, message):
+        return cls(*(getattr(message, name) for name in cls.__slots__))
+
+    @property
+    def chat_id(self):
+        kind, _, key = self.conversation_id.partition(':')
+        return int(key) if kind == 'chat' else None
+
+    @property
+    def group_id(self):
+        kind, _, key = self.conversation_id.partition(':')
+        return key if kind == 'group' else None
+
+
+# ستون‌های مدل به ترتیب فیلدهای رکورد، برای select
+def columns_for(view_class, model):
+    return tuple(getattr(model, name) for name in view_class.__slots__)
+
+
+def load_views(view_class, result):
+    return [view_class(*row) for row in result]
@@ -0,0 +1,46 @@
+import argparse
+import logging
+import sqlite3
+import time
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+# کپی کامل دیتابیس اصلی روی replica با backup API خود SQLite (بدون قفل طولانی روی فایل اصلی)
+def sync(primary_path, replica_path):
+    source = sqlite3.connect(primary_path)
+    target = sqlite3.connect(replica_path, timeout=30)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Periodically copy a primary SQLite database to a read replica file. '
+                    'Run the app with DATABASE_REPLICA_URL=sqlite:////path/to/replica.db '
+                    'to route read-only pages to the copy.'
+    )
+    parser.add_argument('primary', help='path of the primary SQLite file')
+    parser.add_argument('replica', help='path of the replica SQLite file')
+    parser.add_argument('--interval', type=float, default=2.0, help='seconds between syncs')
+    parser.add_argument('--once', action='store_true', help='sync once and exit')
+    args = parser.parse_args()
+
+    while True:
+        started = time.time()
+        try:
+            sync(args.primary, args.replica)
+            logger.info(f"Replica synced in {(time.time() - started) * 1000:.1f} ms")
+        except sqlite3.Error as e:
+            logger.error(f"Replica sync error: {str(e)}")
+        if args.once:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    main()
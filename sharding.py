@@ -0,0 +1,84 @@
+import hashlib
+
+from sqlalchemy.sql import operators, visitors
+from sqlalchemy.sql.elements import BinaryExpression, BindParameter
+
+# نام دیتابیس اصلی (داده‌های سراسری: کاربران، چت‌ها، گروه‌ها، لاگ‌ها)
+PRIMARY = 'primary'
+
+
+# Jump consistent hash (Lamping & Veach): با اضافه شدن شارد n+1 فقط حدود 1/(n+1) کلیدها جابه‌جا می‌شوند
+def jump_hash(key, buckets):
+    b, j = -1, 0
+    while j < buckets:
+        b = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((b + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return b
+
+
+# hash پایدار بین پروسه‌ها و نسخه‌های پایتون (hash() داخلی تصادفی‌سازی می‌شود)
+def stable_key(value):
+    return int.from_bytes(hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def shard_name(index):
+    return f'shard{index}'
+
+
+# مسیریاب شاردها: هر مکالمه (chat:<id> یا group:<id>) همیشه در یک شارد ثابت است
+class ShardRouter:
+    def __init__(self, shard_count):
+        self.shard_count = shard_count
+
+    @property
+    def enabled(self):
+        return self.shard_count > 0
+
+    @property
+    def shards(self):
+        if not self.enabled:
+            return [PRIMARY]
+        return [shard_name(i) for i in range(self.shard_count)]
+
+    def shard_for(self, conversation_id):
+        if not self.enabled:
+            return PRIMARY
+        return shard_name(jump_hash(stable_key(conversation_id), self.shard_count))
+
+    # شاردهای لازم برای یک دستور SQL؛ اگر مکالمه از شرط‌ها معلوم نباشد همه شاردها
+    def shards_for_clause(self, clause, column):
+        conversation_ids = conversation_ids_in(clause, column)
+        if conversation_ids is None:
+            return self.shards
+        return sorted({self.shard_for(conversation_id) for conversation_id in conversation_ids})
+
+
+def _bound_value(element):
+    if isinstance(element, BindParameter):
+        return element.effective_value
+    return None
+
+
+# مقادیر column در شرط‌های «==» و «IN» کل دستور، از جمله subqueryها (مثل count())
+# None یعنی شرطی روی column پیدا نشد
+def conversation_ids_in(clause, column):
+    if clause is None:
+        return None
+    found = []
+    for element in visitors.iterate(clause):
+        if not isinstance(element, BinaryExpression):
+            continue
+        left, right = element.left, element.right
+        if getattr(right, 'key', None) == column.key and getattr(right, 'table', None) is column.table:
+            left, right = right, left
+        if getattr(left, 'key', None) != column.key or getattr(left, 'table', None) is not column.table:
+            continue
+        value = _bound_value(right)
+        if value is None:
+            continue
+        if element.operator is operators.eq:
+            found.append(value)
+        elif element.operator is operators.in_op:
+            found.extend(value)
+    return found or None
@@ -0,0 +1,138 @@
+import os
+import tempfile
+import threading
+import time
+from datetime import timezone
+
+try:
+    import fcntl
+except ImportError:  # ویندوز؛ فقط برای اجرای محلی تک‌پروسه‌ای
+    fcntl = None
+
+# شناسه‌های زمان‌مرتب به سبک Snowflake:
+#   42 بیت میلی‌ثانیه از EPOCH | 6 بیت شناسه worker | 5 بیت شمارنده در هر میلی‌ثانیه
+# مجموع 53 بیت است تا شناسه در ستون 64 بیتی جا شود و در JSON/JavaScript بدون از دست رفتن دقت منتقل شود.
+EPOCH_MS = 1577836800000  # 2020-01-01T00:00:00Z
+WORKER_BITS = 6
+SEQUENCE_BITS = 5
+MAX_WORKER_ID = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+# شناسه worker رزرو شده برای مهاجرت داده‌های قدیمی (worker زنده هرگز آن را نمی‌گیرد)
+MIGRATION_WORKER_ID = MAX_WORKER_ID
+
+
+# بازه شناسه‌های worker این نمونه (کانتینر یا سرور)؛ شناسه‌ها بین SNOWFLAKE_INSTANCES نمونه تقسیم می‌شوند
+# و در استقرار چندنمونه‌ای هر نمونه باید SNOWFLAKE_INSTANCE_ID یکتای خود را داشته باشد، وگرنه برنامه بالا نمی‌آید.
+def instance_worker_ids():
+    instances = int(os.environ.get('SNOWFLAKE_INSTANCES', 1))
+    instance_id = os.environ.get('SNOWFLAKE_INSTANCE_ID')
+    if instances > 1 and instance_id is None:
+        raise RuntimeError('SNOWFLAKE_INSTANCE_ID must be set when SNOWFLAKE_INSTANCES > 1')
+    instance_id = int(instance_id or 0)
+    size = MAX_WORKER_ID // instances
+    if size < 1 or not 0 <= instance_id < instances:
+        raise RuntimeError(f'Invalid Snowflake instance {instance_id} of {instances} (at most {MAX_WORKER_ID} instances)')
+    return range(instance_id * size, (instance_id + 1) * size)
+
+
+# هر پروسه یک شناسه آزاد از بازه نمونه را با قفل فایل اجاره می‌کند؛ قفل با پایان پروسه خودبه‌خود آزاد می‌شود
+# پس workerهای هم‌زمان یک نمونه هرگز شناسه مشترک نمی‌گیرند (برخلاف pid % N).
+def lease_worker_id(lock_dir=None):
+    worker_ids = instance_worker_ids()
+    if fcntl is None:
+        return worker_ids[os.getpid() % len(worker_ids)], None
+    lock_dir = lock_dir or os.environ.get('SNOWFLAKE_LOCK_DIR') or os.path.join(tempfile.gettempdir(), 'snowflake-workers')
+    os.makedirs(lock_dir, exist_ok=True)
+    for worker_id in worker_ids:
+        lock_file = open(os.path.join(lock_dir, f'worker-{worker_id}.lock'), 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            continue
+        return worker_id, lock_file
+    raise RuntimeError(f'No free Snowflake worker id in {worker_ids.start}-{worker_ids.stop - 1} (lock dir {lock_dir})')
+
+
+def compose(timestamp_ms, worker_id, sequence):
+    return ((timestamp_ms - EPOCH_MS) << (WORKER_BITS + SEQUENCE_BITS)) | (worker_id << SEQUENCE_BITS) | sequence
+
+
+# فاصله شناسه‌های ساخته شده در یک بازه زمانی؛ برای عقب بردن cursor به اندازه چند ثانیه
+def span(milliseconds):
+    return milliseconds << (WORKER_BITS + SEQUENCE_BITS)
+
+
+# بخش زمانی شناسه؛ برای تبدیل زمان به cursor یا برعکس
+def timestamp_ms(snowflake_id):
+    return (snowflake_id >> (WORKER_BITS + SEQUENCE_BITS)) + EPOCH_MS
+
+
+class SnowflakeGenerator:
+    def __init__(self, worker_id=None):
+        self._worker_id = worker_id
+        self._pid = None
+        self._lease = None
+        self._lock = threading.Lock()
+        self._last_ms = -1
+        self._sequence = 0
+
+    @property
+    def worker_id(self):
+        # بعد از fork هر worker شناسه جداگانه خود را اجاره می‌کند
+        if self._worker_id is not None:
+            return self._worker_id
+        if self._pid != os.getpid():
+            self._cached_worker_id, self._lease = lease_worker_id()
+            self._pid = os.getpid()
+        return self._cached_worker_id
+
+    def next_id(self):
+        with self._lock:
+            now = int(time.time() * 1000)
+            # ساعت سیستم به عقب برگشته: از آخرین میلی‌ثانیه استفاده شده ادامه می‌دهیم
+            if now < self._last_ms:
+                now = self._last_ms
+            if now == self._last_ms:
+                self._sequence += 1
+                if self._sequence > MAX_SEQUENCE:
+                    while now <= self._last_ms:
+                        time.sleep(0.0001)
+                        now = int(time.time() * 1000)
+                    self._sequence = 0
+            else:
+                self._sequence = 0
+            self._last_ms = now
+            return compose(now, self.worker_id, self._sequence)
+
+
+# تولید شناسه برای رکوردهای قدیمی بر اساس زمان ثبتشان؛ شمارنده برای رکوردهای هم‌زمان افزایش می‌یابد
+class TimestampIdAllocator:
+    def __init__(self, worker_id=MIGRATION_WORKER_ID):
+        self.worker_id = worker_id
+        self._last_ms = -1
+        self._sequence = 0
+
+    def id_for(self, moment):
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+        ms = max(int(moment.timestamp() * 1000), EPOCH_MS)
+        if ms <= self._last_ms:
+            ms = self._last_ms
+            self._sequence += 1
+            if self._sequence > MAX_SEQUENCE:
+                ms += 1
+                self._sequence = 0
+        else:
+            self._sequence = 0
+        self._last_ms = ms
+        return compose(ms, self.worker_id, self._sequence)
+
+
+generator = SnowflakeGenerator()
+
+
+def next_id():
+    return generator.next_id()
+